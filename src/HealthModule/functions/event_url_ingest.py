@@ -0,0 +1,195 @@
+"""Store Health events in the event URL table, keeping only the newest version of every event and account."""
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from botocore.exceptions import ClientError
+
+from heidi_common import HEALTH_TIME_FORMAT, get_client, get_resource, get_table, overflow_key
+
+# Entity lists above this size are stored compressed, compressed lists above the chunk size
+# are split across overflow items so no item gets near the 400 KB DynamoDB limit
+INLINE_ENTITIES_BYTES = int(os.environ.get('InlineEntitiesBytes', '65536'))
+ENTITY_CHUNK_BYTES = int(os.environ.get('EntityChunkBytes', '300000'))
+SUMMARY_ENTITIES = 50
+# Item recording the last flush of the API cache, shared by all concurrent invocations
+FLUSH_MARKER_KEY = {'eventArn': 'heidi#apiCacheFlush', 'account': 'heidi#apiCacheFlush'}
+
+
+def last_updated_epoch(payload):
+    if payload.get('lastUpdatedTimeEpoch'):
+        return int(payload['lastUpdatedTimeEpoch'])
+    try:
+        return int(datetime.strptime(payload['lastUpdatedTime'], HEALTH_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+
+def build_item(event):
+    # Extract the data from the event
+    payload = event['detail']
+    entities = [entity['entityValue'] for entity in payload.get('affectedEntities', []) if entity.get('entityValue')]
+    event_data = {
+        'eventDescription': payload.get('eventDescription', [{'latestDescription': None}])[0]['latestDescription'],
+        'affectedEntities': ', '.join(entities),
+        # Events of the organizational view name the affected account, the event account is the management account
+        'account': payload.get('affectedAccount') or event['account']
+    }
+    event_data.update((key, value) for key, value in payload.items() if key not in event_data)
+    event_data['lastUpdatedTimeEpoch'] = last_updated_epoch(payload)
+    event_data['payloadHash'] = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    chunks = []
+    if len(event_data['affectedEntities'].encode('utf-8')) > INLINE_ENTITIES_BYTES:
+        compressed = gzip.compress('\n'.join(entities).encode('utf-8'))
+        # Keep a readable summary for the event detail page
+        event_data['affectedEntities'] = ', '.join(entities[:SUMMARY_ENTITIES]) + f" ... and {len(entities) - SUMMARY_ENTITIES} more"
+        event_data['affectedEntitiesCount'] = len(entities)
+        if len(compressed) <= ENTITY_CHUNK_BYTES:
+            event_data['affectedEntitiesGzip'] = compressed
+        else:
+            chunks = [compressed[start:start + ENTITY_CHUNK_BYTES] for start in range(0, len(compressed), ENTITY_CHUNK_BYTES)]
+    event_data['entityChunks'] = len(chunks)
+    return event_data, chunks
+
+
+def current_versions(keys):
+    # One batched read is far cheaper than failing conditional writes of large items
+    versions = {}
+    request = {os.environ['DynamoDBName']: {'Keys': keys, 'ProjectionExpression': 'eventArn, account, lastUpdatedTimeEpoch, payloadHash, entityChunks'}}
+    while request:
+        response = get_resource('dynamodb').batch_get_item(RequestItems=request)
+        for item in response['Responses'].get(os.environ['DynamoDBName'], []):
+            versions[(item['eventArn'], item['account'])] = item
+        request = response.get('UnprocessedKeys')
+        if request:
+            time.sleep(0.1)
+    return versions
+
+
+def is_newer(item, current):
+    if current is None:
+        return True
+    current_epoch = int(current.get('lastUpdatedTimeEpoch', 0))
+    return item['lastUpdatedTimeEpoch'] > current_epoch or (item['lastUpdatedTimeEpoch'] == current_epoch and item['payloadHash'] != current.get('payloadHash'))
+
+
+def chunk_keys(item, count):
+    return [{'eventArn': item['eventArn'], 'account': overflow_key(item['account'], item['payloadHash'], index)} for index in range(count)]
+
+
+def write_item(item, chunks, current):
+    table = get_table(os.environ['DynamoDBName'])
+    # Overflow items are keyed by the payload hash and written before the event item, so the
+    # event item never points at chunks that are missing or belong to another version
+    new_keys = chunk_keys(item, len(chunks))
+    with table.batch_writer() as batch:
+        for key, chunk in zip(new_keys, chunks):
+            batch.put_item(Item={**key, 'data': chunk})
+    # Items written before versioning have no lastUpdatedTimeEpoch and are always replaced
+    try:
+        table.put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(eventArn) OR attribute_not_exists(lastUpdatedTimeEpoch) OR lastUpdatedTimeEpoch < :epoch OR (lastUpdatedTimeEpoch = :epoch AND payloadHash <> :hash)',
+            ExpressionAttributeValues={':epoch': item['lastUpdatedTimeEpoch'], ':hash': item['payloadHash']}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # A newer version won, drop our chunks unless it shares them
+        stored = table.get_item(Key={'eventArn': item['eventArn'], 'account': item['account']}, ProjectionExpression='payloadHash', ConsistentRead=True).get('Item', {})
+        if new_keys and stored.get('payloadHash') != item['payloadHash']:
+            delete_items(new_keys)
+        return False
+    if current and current.get('payloadHash'):
+        delete_items([key for key in chunk_keys(current, int(current.get('entityChunks', 0))) if key not in new_keys])
+    return True
+
+
+def delete_items(keys):
+    if not keys:
+        return
+    with get_table(os.environ['DynamoDBName']).batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
+
+
+def flush_api_cache():
+    # Lookups of a rewritten event must not be served from the stage cache. Flushing drops every
+    # cached lookup, so it runs at most once per interval and the short cache TTL covers the rest
+    if os.environ.get('ApiCacheEnabled') != 'yes':
+        return
+    now = int(time.time())
+    try:
+        get_table(os.environ['DynamoDBName']).update_item(
+            Key=FLUSH_MARKER_KEY,
+            UpdateExpression='SET flushedAt = :now',
+            ConditionExpression='attribute_not_exists(flushedAt) OR flushedAt < :cutoff',
+            ExpressionAttributeValues={':now': now, ':cutoff': now - int(os.environ.get('ApiCacheFlushIntervalInSeconds', '30'))}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            print(f"Error flushing API cache: {e}")
+        return
+    try:
+        get_client('apigateway').flush_stage_cache(restApiId=os.environ['RestApiId'], stageName=os.environ['StageName'])
+    except Exception as e:
+        print(f"Error flushing API cache: {e}")
+
+
+def incoming_events(event):
+    # Invoked by EventBridge with one event or by SQS with a batch of them
+    if 'Records' in event:
+        return [(record['messageId'], json.loads(record['body'], parse_float=Decimal)) for record in event['Records']]
+    return [(None, event)]
+
+
+def lambda_handler(event, context):
+    try:
+        latest = {}
+        failures = []
+        for message_id, health_event in incoming_events(event):
+            try:
+                item, chunks = build_item(health_event)
+            except Exception as e:
+                print(f"Skipping malformed event {message_id}: {e}")
+                continue
+            key = (item['eventArn'], item['account'])
+            # Within a batch only the newest version of every event and account is written
+            if key not in latest or is_newer(item, latest[key][0]):
+                latest[key] = (item, chunks, message_id)
+
+        versions = current_versions([{'eventArn': event_arn, 'account': account} for event_arn, account in latest]) if latest else {}
+        written = 0
+        for key, (item, chunks, message_id) in latest.items():
+            if not is_newer(item, versions.get(key)):
+                continue
+            try:
+                written += write_item(item, chunks, versions.get(key))
+            except Exception as e:
+                print(f"Error writing {key}: {e}")
+                if message_id:
+                    failures.append({'itemIdentifier': message_id})
+                else:
+                    raise
+        print(f"Wrote {written} of {len(latest)} events")
+        if written:
+            flush_api_cache()
+        if 'Records' in event:
+            return {'batchItemFailures': failures}
+        return {
+            'statusCode': 200,
+            'body': json.dumps('Data inserted successfully.')
+        }
+    except Exception as e:
+        # Let SQS retry the whole batch, EventBridge invocations return the error message
+        if 'Records' in event:
+            raise
+        return {
+            'statusCode': 500,
+            'body': json.dumps(str(e))
+        }
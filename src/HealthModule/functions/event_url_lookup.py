@@ -0,0 +1,79 @@
+"""Return event URL items for a batch of <eventArn>|<account> keys in one request."""
+import gzip
+import json
+import os
+import time
+
+from heidi_common import dumps, get_resource, overflow_key
+
+MAX_KEYS = int(os.environ.get('MaxKeys', '500'))
+
+
+def parse_keys(event):
+    # GET ?keys=<eventArn>|<account>,... or POST {"keys": [{"eventArn": ..., "account": ...}]}
+    if event.get('httpMethod') == 'POST':
+        body = json.loads(event.get('body') or '{}')
+        keys = [(key['eventArn'], key['account']) for key in body.get('keys', [])]
+        include_entities = bool(body.get('includeEntities'))
+    else:
+        params = event.get('queryStringParameters') or {}
+        keys = [tuple(key.split('|', 1)) for key in (params.get('keys') or '').split(',') if '|' in key]
+        include_entities = params.get('includeEntities') == 'true'
+    return list(dict.fromkeys(keys)), include_entities
+
+
+def batch_get(keys, projection=None):
+    items = []
+    for start in range(0, len(keys), 100):
+        request_keys = {'Keys': [{'eventArn': event_arn, 'account': account} for event_arn, account in keys[start:start + 100]]}
+        if projection:
+            request_keys['ProjectionExpression'] = projection
+        request = {os.environ['DynamoDBName']: request_keys}
+        while request:
+            response = get_resource('dynamodb').batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(os.environ['DynamoDBName'], []))
+            request = response.get('UnprocessedKeys')
+            if request:
+                time.sleep(0.1)
+    return items
+
+
+def full_entities(item):
+    # Large entity lists are stored compressed, the largest split across overflow items
+    if 'affectedEntitiesGzip' in item:
+        return gzip.decompress(bytes(item['affectedEntitiesGzip'])).decode('utf-8').split('\n')
+    chunks = int(item.get('entityChunks', 0))
+    if chunks:
+        overflow = batch_get([(item['eventArn'], overflow_key(item['account'], item['payloadHash'], index)) for index in range(chunks)])
+        data = b''.join(bytes(chunk['data']) for chunk in sorted(overflow, key=lambda chunk: int(chunk['account'].rsplit('#', 1)[1])))
+        return gzip.decompress(data).decode('utf-8').split('\n')
+    return [entity for entity in item.get('affectedEntities', '').split(', ') if entity]
+
+
+def response(status, body):
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json'},
+        'body': dumps(body)
+    }
+
+
+def lambda_handler(event, context):
+    try:
+        keys, include_entities = parse_keys(event)
+        if not keys:
+            return response(400, {'message': 'Provide keys as <eventArn>|<account>'})
+        if len(keys) > MAX_KEYS:
+            return response(400, {'message': f"At most {MAX_KEYS} keys per request"})
+        items = []
+        for item in batch_get(keys):
+            if include_entities:
+                item['affectedEntities'] = full_entities(item)
+            item.pop('affectedEntitiesGzip', None)
+            items.append(item)
+        found = {(item['eventArn'], item['account']) for item in items}
+        missing = [{'eventArn': event_arn, 'account': account} for event_arn, account in keys if (event_arn, account) not in found]
+        return response(200, {'items': items, 'missing': missing})
+    except Exception as e:
+        print(e)
+        return response(500, {'message': str(e)})
@@ -0,0 +1,50 @@
+"""Clients and serialization shared by the packaged Heidi Lambda functions.
+
+Clients are created on first use and reused by warm invocations, so module init
+only pays for the imports.
+"""
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import boto3
+
+HEALTH_TIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+_clients = {}
+
+
+def get_client(service, region=None):
+    if (service, region) not in _clients:
+        _clients[(service, region)] = boto3.client(service, region)
+    return _clients[(service, region)]
+
+
+def get_resource(service, region=None):
+    if ('resource', service, region) not in _clients:
+        _clients[('resource', service, region)] = boto3.resource(service, region)
+    return _clients[('resource', service, region)]
+
+
+def get_table(table_name):
+    if ('table', table_name) not in _clients:
+        _clients[('table', table_name)] = get_resource('dynamodb').Table(table_name)
+    return _clients[('table', table_name)]
+
+
+def to_json(value):
+    # DynamoDB numbers come back as Decimal and EventBridge payloads are parsed with parse_float=Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Unsupported type {type(value)}")
+
+
+def dumps(value):
+    return json.dumps(value, default=to_json)
+
+
+def overflow_key(account, payload_hash, index):
+    """Sort key of the index-th overflow item holding the compressed entity list of one version of an event item"""
+    return f"{account}#entities#{payload_hash[:16]}#{index}"
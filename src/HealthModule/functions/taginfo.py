@@ -0,0 +1,49 @@
+"""Look up the tags of the entities of a Health event and put them on the DataCollection bus."""
+import os
+import re
+
+from heidi_common import dumps, get_client
+
+
+def lambda_handler(event, context):
+    try:
+        # Extract the data from the event
+        payload = event['detail']
+        for entity in payload.get('affectedEntities', []):
+            entity_value = entity.get('entityValue', '')
+            if re.match(r'^arn:.*', entity_value):
+                resource_explorer(entity_value)
+    except Exception as e:
+        print(e)
+
+
+def resource_explorer(entityValue):
+    try:
+        view_arn = os.environ['ResourceExplorerViewArn']
+        resource_explorer = get_client('resource-explorer-2', view_arn.split(":")[3])
+        query_string = f"id:{entityValue}"
+        response = resource_explorer.search(QueryString=query_string, ViewArn=view_arn)
+        tag_data = {}
+        for resource in response.get('Resources', []):
+            arn = resource.get('Arn')
+            tags = [{'entityKey': item['Key'], 'entityValue': item['Value']} for prop in resource.get('Properties', []) for item in prop.get('Data', [])]
+            tag_data = {'entityArn': arn, 'tags': tags}
+            # Send untagged resources too, so tags removed since the last lookup are cleared
+            send_event(tag_data)
+    except Exception as e:
+        print(e)
+
+
+def send_event(tag_data):
+    try:
+        response = get_client('events').put_events(
+            Entries=[{
+                'Source': 'heidi.taginfo',
+                'DetailType': 'Heidi tags from resource explorer',
+                'Detail': dumps(tag_data),
+                'EventBusName': os.environ['EventBusName']
+            }]
+        )
+        print(response)
+    except Exception as e:
+        print(e)
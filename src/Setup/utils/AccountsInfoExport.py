@@ -0,0 +1,194 @@
+"""Export the AWS Organizations account list as the accountsinfo reference file.
+
+Run from the management or a delegated administrator account. Accounts are paged
+with list_accounts, OU paths come from one walk of the organization tree and tags
+are fetched concurrently under a rate limiter. State from the previous run is
+kept under DataCollection-metadata, so later runs only fetch tags for accounts that
+joined or whose tags are older than the refresh interval, and the file is only
+rewritten when its content changes.
+"""
+import csv
+import hashlib
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+from botocore.config import Config
+
+from DataLakeIO import read_object, write_object
+
+ACCOUNTS_INFO_PREFIX = "DataCollection-metadata/ReferenceOds/AccountsInfo"
+EXPORT_FILE = "accountsinfo_export.csv"
+# Kept outside the table location so Athena does not read it as a CSV row
+STATE_KEY = "DataCollection-metadata/ExportState/accountsinfo.json"
+
+HEADER = ['Account ID', 'ARN', 'Email', 'Name', 'Status', 'Joined method', 'Joined timestamp', 'Tag', 'OU path']
+
+organizations_client = boto3.client('organizations', config=Config(retries={'mode': 'adaptive', 'max_attempts': 10}))
+
+
+class RateLimiter:
+    """Allow at most rate calls per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def list_all(method, key, limiter, **kwargs):
+    """Collect every page of an Organizations list call, waiting on the limiter before each request"""
+    items = []
+    while True:
+        limiter.wait()
+        page = getattr(organizations_client, method)(**kwargs)
+        items.extend(page[key])
+        if not page.get('NextToken'):
+            return items
+        kwargs['NextToken'] = page['NextToken']
+
+
+def list_accounts(limiter):
+    return list_all('list_accounts', 'Accounts', limiter)
+
+
+def list_ou_paths(limiter, max_workers):
+    """Return {account id: OU path}, walking each level of the tree concurrently"""
+    paths = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        level = [(root['Id'], root['Name']) for root in list_all('list_roots', 'Roots', limiter)]
+        while level:
+            accounts = executor.map(lambda parent: list_all('list_accounts_for_parent', 'Accounts', limiter, ParentId=parent[0]), level)
+            units = executor.map(lambda parent: list_all('list_organizational_units_for_parent', 'OrganizationalUnits', limiter, ParentId=parent[0]), level)
+            next_level = []
+            for (_, path), parent_accounts, parent_units in zip(level, accounts, units):
+                for account in parent_accounts:
+                    paths[account['Id']] = path
+                next_level.extend((unit['Id'], f"{path}/{unit['Name']}") for unit in parent_units)
+            level = next_level
+    return paths
+
+
+def fetch_tags(account_ids, limiter, max_workers):
+    """Return {account id: {key: value}} for the given accounts"""
+    def account_tags(account_id):
+        tags = list_all('list_tags_for_resource', 'Tags', limiter, ResourceId=account_id)
+        return {tag['Key']: tag['Value'] for tag in tags}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(account_ids, executor.map(account_tags, account_ids)))
+
+
+def account_tag(tags, tag_key):
+    if tag_key:
+        return tags.get(tag_key, '')
+    return ', '.join(f"{key}={value}" for key, value in sorted(tags.items()))
+
+
+def load_state(location):
+    try:
+        return json.loads(read_object(location, STATE_KEY))
+    except Exception:
+        return {'accounts': {}, 'file_hash': None}
+
+
+def plan_tag_refresh(accounts, state, refresh_hours):
+    """Return the accounts whose tags must be fetched: new ones and those not refreshed recently"""
+    cutoff = time.time() - refresh_hours * 3600
+    known = state['accounts']
+    return [
+        account['Id'] for account in accounts
+        if account['Id'] not in known or known[account['Id']].get('tags_fetched_at', 0) < cutoff
+    ]
+
+
+def render_csv(accounts, tags, ou_paths, tag_key):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    writer.writerow(HEADER)
+    for account in sorted(accounts, key=lambda item: item['Id']):
+        joined = account.get('JoinedTimestamp')
+        writer.writerow([
+            account['Id'],
+            account['Arn'],
+            account.get('Email', ''),
+            account.get('Name', ''),
+            account.get('Status', ''),
+            account.get('JoinedMethod', ''),
+            joined.astimezone(timezone.utc).isoformat() if joined else '',
+            account_tag(tags.get(account['Id'], {}), tag_key),
+            ou_paths.get(account['Id'], ''),
+        ])
+    return buffer.getvalue().encode('utf-8')
+
+
+def export(location, tag_key='', refresh_hours=24, requests_per_second=5, max_workers=8):
+    """Write the accountsinfo reference file; returns a summary of what changed"""
+    limiter = RateLimiter(requests_per_second)
+    state = load_state(location)
+    accounts = list_accounts(limiter)
+    account_ids = {account['Id'] for account in accounts}
+    joined = account_ids - set(state['accounts'])
+    left = set(state['accounts']) - account_ids
+    print(f"Found {len(accounts)} accounts ({len(joined)} joined, {len(left)} left since last export)")
+
+    ou_paths = list_ou_paths(limiter, max_workers)
+    refresh = plan_tag_refresh(accounts, state, refresh_hours)
+    print(f"Fetching tags for {len(refresh)} accounts")
+    fetched = fetch_tags(refresh, limiter, max_workers)
+
+    now = time.time()
+    tags = {}
+    tags_changed = 0
+    for account_id in sorted(account_ids):
+        previous = state['accounts'].get(account_id, {})
+        if account_id in fetched:
+            tags[account_id] = fetched[account_id]
+            if account_id not in joined and previous.get('tags') != fetched[account_id]:
+                tags_changed += 1
+            state['accounts'][account_id] = {'tags': fetched[account_id], 'tags_fetched_at': now}
+        else:
+            tags[account_id] = previous.get('tags', {})
+    for account_id in left:
+        del state['accounts'][account_id]
+
+    body = render_csv(accounts, tags, ou_paths, tag_key)
+    file_hash = hashlib.sha256(body).hexdigest()
+    written = file_hash != state.get('file_hash')
+    if written:
+        write_object(location, f"{ACCOUNTS_INFO_PREFIX}/{EXPORT_FILE}", body)
+    state['file_hash'] = file_hash
+    state['exported_at'] = datetime.now(timezone.utc).isoformat()
+    write_object(location, STATE_KEY, json.dumps(state).encode('utf-8'))
+    return {'accounts': len(accounts), 'joined': len(joined), 'left': len(left), 'tags_changed': tags_changed, 'written': written}
+
+
+def get_user_input():
+    location = input("Enter DataCollection location (s3://<DataCollectionBucket> or local directory): ").strip()
+    tag_key = input("Enter account tag key to use as Tag, Hit enter to include all tags as key=value: ").strip()
+    refresh_hours = input("Enter hours before account tags are fetched again, Hit enter to use default (24): ").strip() or '24'
+    return location, tag_key, float(refresh_hours)
+
+
+def main():
+    location, tag_key, refresh_hours = get_user_input()
+    summary = export(location, tag_key, refresh_hours)
+    status = f"written to {location}/{ACCOUNTS_INFO_PREFIX}/{EXPORT_FILE}" if summary['written'] else "unchanged, nothing written"
+    print(f"\nExport complete: {summary['accounts']} accounts, {summary['joined']} joined, {summary['left']} left, "
+          f"{summary['tags_changed']} with changed tags; reference file {status}")
+
+
+if __name__ == "__main__":
+    main()
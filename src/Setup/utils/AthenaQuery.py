@@ -0,0 +1,139 @@
+"""Athena query execution shared by the Setup utilities.
+
+Queries go through the shared Athena client of the region (ClientPool), ask Athena to reuse results
+of identical queries (ResultReuseConfiguration) and are cached locally, keyed
+by the normalized SQL, the database and the partitions the caller says the
+query reads. Independent queries can be submitted together with run_queries.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from ClientPool import get_client
+
+CACHE_DIR = ".athena_cache"
+DEFAULT_MAX_AGE_MINUTES = 60
+
+def get_athena_client(region):
+    """Return the shared Athena client of a region, created on first use"""
+    return get_client('athena', region)
+
+
+def normalize_sql(sql):
+    """Collapse whitespace outside string literals and drop trailing semicolons"""
+    parts = re.split(r"('(?:[^']|'')*')", sql.strip().rstrip(';').strip())
+    return ''.join(part if index % 2 else re.sub(r'\s+', ' ', part) for index, part in enumerate(parts))
+
+
+def cache_key(sql, database, partitions=()):
+    key = json.dumps([normalize_sql(sql), database, sorted(partitions)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def read_cache(key, max_age_minutes):
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - entry['created'] > max_age_minutes * 60:
+        return None
+    return entry['results']
+
+
+def write_cache(key, results):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(os.path.join(CACHE_DIR, f"{key}.json"), 'w') as f:
+        json.dump({'created': time.time(), 'results': results}, f)
+
+
+def start_query(athena_client, sql, database, output_location=None, workgroup=None, max_age_minutes=DEFAULT_MAX_AGE_MINUTES):
+    kwargs = {'QueryString': sql, 'QueryExecutionContext': {'Database': database}}
+    if output_location:
+        kwargs['ResultConfiguration'] = {'OutputLocation': output_location}
+    if workgroup:
+        kwargs['WorkGroup'] = workgroup
+    if max_age_minutes:
+        kwargs['ResultReuseConfiguration'] = {'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': max_age_minutes}}
+    try:
+        return athena_client.start_query_execution(**kwargs)['QueryExecutionId']
+    except ClientError as e:
+        # Result reuse needs Athena engine version 3, run without it on older workgroups
+        if 'ResultReuseConfiguration' not in kwargs or e.response['Error']['Code'] != 'InvalidRequestException':
+            raise
+        del kwargs['ResultReuseConfiguration']
+        return athena_client.start_query_execution(**kwargs)['QueryExecutionId']
+
+
+def wait_for_query(athena_client, query_execution_id, poll_seconds=1):
+    """Wait for the query to finish and return its QueryExecution"""
+    while True:
+        execution = athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        if execution['Status']['State'] in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+            return execution
+        time.sleep(poll_seconds)
+
+
+def fetch_results(athena_client, query_execution_id):
+    """Return all result pages merged into one get_query_results response"""
+    results = None
+    for page in athena_client.get_paginator('get_query_results').paginate(QueryExecutionId=query_execution_id):
+        if results is None:
+            results = {'ResultSet': {'Rows': page['ResultSet']['Rows'], 'ResultSetMetadata': page['ResultSet'].get('ResultSetMetadata', {})}}
+        else:
+            results['ResultSet']['Rows'].extend(page['ResultSet']['Rows'])
+    return results
+
+
+def run_query(sql, database, region, output_location=None, workgroup=None, partitions=(), max_age_minutes=DEFAULT_MAX_AGE_MINUTES, use_cache=True):
+    """Run a query and return its results in the get_query_results format.
+
+    partitions names the partitions the query reads, e.g. ['2024/03/01'], so
+    a query over other partitions never hits the cached results.
+    """
+    key = cache_key(sql, database, partitions)
+    if use_cache and max_age_minutes:
+        cached = read_cache(key, max_age_minutes)
+        if cached is not None:
+            print("Using cached query results")
+            return cached
+
+    athena_client = get_athena_client(region)
+    query_execution_id = start_query(athena_client, sql, database, output_location, workgroup, max_age_minutes if use_cache else 0)
+    print(f"Query execution started with ID: {query_execution_id}")
+    execution = wait_for_query(athena_client, query_execution_id)
+    status = execution['Status']['State']
+    if status != 'SUCCEEDED':
+        raise RuntimeError(f"Query {query_execution_id} {status}: {execution['Status'].get('StateChangeReason', 'Unknown error')}")
+    if execution.get('Statistics', {}).get('ResultReuseInformation', {}).get('ReusedPreviousResult'):
+        print("Athena reused the results of a previous execution")
+
+    results = fetch_results(athena_client, query_execution_id)
+    if use_cache and max_age_minutes:
+        write_cache(key, results)
+    return results
+
+
+def run_queries(queries, database, region, output_location=None, workgroup=None, max_age_minutes=DEFAULT_MAX_AGE_MINUTES, max_workers=4):
+    """Run independent queries concurrently; queries is a list of SQL strings or (sql, partitions) pairs"""
+    def run(query):
+        sql, partitions = query if isinstance(query, tuple) else (query, ())
+        return run_query(sql, database, region, output_location, workgroup, partitions, max_age_minutes)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, queries))
+
+
+def result_rows(results):
+    """Return the rows of a result as dicts keyed by column name"""
+    rows = results['ResultSet']['Rows']
+    if not rows:
+        return []
+    header = [field.get('VarCharValue') for field in rows[0]['Data']]
+    return [dict(zip(header, [field.get('VarCharValue') for field in row['Data']])) for row in rows[1:]]
@@ -0,0 +1,112 @@
+"""AWS clients, rate limits and Resource Explorer lookups shared by the Setup utilities.
+
+Clients are created once per service and region and reused by every job of a
+process. Calls of services listed in RATE_LIMITS wait on one limiter per service
+and region, whichever job or thread makes them. A complete Resource Explorer
+listing of a view is kept in memory, so TagBackFill and ListAffectedEntities run
+by HeidiRunner in one process list the view once.
+"""
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+# The Health API is global, its endpoint is in us-east-1
+HEALTH_REGION = "us-east-1"
+# Calls per second per service and region, below the throttling limits of the APIs
+RATE_LIMITS = {'health': 10, 'events': 50, 'resource-explorer-2': 5}
+# PutEvents takes at most 10 entries and 256 KB per call
+PUT_EVENTS_MAX_ENTRIES = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+CLIENT_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
+
+_clients = {}
+_limiters = {}
+_clients_lock = threading.Lock()
+_resource_tags = {}
+_resource_tags_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self, **kwargs):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def get_client(service, region=None):
+    """Return the shared client of a service and region, created on first use"""
+    with _clients_lock:
+        key = (service, region)
+        if key not in _clients:
+            client = boto3.client(service, region_name=region, config=CLIENT_CONFIG)
+            if service in RATE_LIMITS:
+                _limiters[key] = RateLimiter(RATE_LIMITS[service])
+                client.meta.events.register('before-call', _limiters[key].wait)
+            _clients[key] = client
+        return _clients[key]
+
+
+def event_bus_arn(account_id, region, resource_prefix):
+    return f"arn:aws:events:{region}:{account_id}:event-bus/{resource_prefix}DataCollectionBus-{account_id}"
+
+
+def get_event_bus_client(bus_arn):
+    """Return the shared EventBridge client of the region of an event bus ARN"""
+    return get_client('events', bus_arn.split(':')[3])
+
+
+def put_events(bus_arn, entries):
+    """Send entries in as few PutEvents calls as the limits allow, return the number of entries that failed"""
+    client = get_event_bus_client(bus_arn)
+    failed = 0
+    batch, batch_size = [], 0
+    for entry in entries + [None]:
+        size = sum(len(str(value).encode('utf-8')) for value in entry.values()) if entry else 0
+        if batch and (entry is None or len(batch) == PUT_EVENTS_MAX_ENTRIES or batch_size + size > PUT_EVENTS_MAX_BYTES):
+            failed += client.put_events(Entries=batch).get('FailedEntryCount', 0)
+            batch, batch_size = [], 0
+        if entry:
+            batch.append(entry)
+            batch_size += size
+    return failed
+
+
+def resource_tag_list(resource):
+    return [{'entityKey': item['Key'], 'entityValue': item['Value']}
+            for prop in resource.get('Properties', [])
+            for item in prop.get('Data', [])]
+
+
+def cached_resource_tags(view_arn):
+    """Return {arn: tags} of a view listed completely earlier in this process, or None"""
+    with _resource_tags_lock:
+        return _resource_tags.get(view_arn)
+
+
+def iter_resource_tags(view_arn, page_size=1000):
+    """Yield (arn, tags) of every resource of a view, from memory when it was listed before"""
+    cached = cached_resource_tags(view_arn)
+    if cached is not None:
+        yield from cached.items()
+        return
+    listing = {}
+    paginator = get_client('resource-explorer-2', view_arn.split(':')[3]).get_paginator('list_resources')
+    for page in paginator.paginate(ViewArn=view_arn, PaginationConfig={'PageSize': page_size}):
+        for resource in page.get('Resources', []):
+            listing[resource.get('Arn')] = resource_tag_list(resource)
+            yield resource.get('Arn'), listing[resource.get('Arn')]
+    # Only a listing that ran to the end is reused
+    with _resource_tags_lock:
+        _resource_tags[view_arn] = listing
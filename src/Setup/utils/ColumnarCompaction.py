@@ -0,0 +1,173 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from DataLakeIO import delete_object, iter_json_records, list_objects, list_partitions, read_object, write_object
+from GlueSchema import COMPACTED_PREFIX, DATA_PREFIX, TABLES, all_sources, parse_hive_type, table_for_source
+
+MANIFEST_FILE = "_manifest.json"  # Athena skips files starting with an underscore
+
+ARROW_PRIMITIVES = {
+    'string': pa.string(),
+    'bigint': pa.int64(),
+    'int': pa.int32(),
+    'double': pa.float64(),
+    'boolean': pa.bool_(),
+    'timestamp': pa.timestamp('ms'),
+}
+
+
+def arrow_type(hive_type):
+    """Map a parsed Hive type onto the matching Arrow type (struct fields lower-cased)"""
+    if isinstance(hive_type, tuple):
+        kind, inner = hive_type
+        if kind == 'array':
+            return pa.list_(arrow_type(inner))
+        return pa.struct([pa.field(name.lower(), arrow_type(field_type)) for name, field_type in inner])
+    return ARROW_PRIMITIVES[hive_type]
+
+
+def table_columns(table_name):
+    """Return [(column, parsed hive type)] for a Glue table"""
+    return [(name, parse_hive_type(hive_type)) for name, hive_type in TABLES[table_name]['columns']]
+
+
+def arrow_schema(table_name):
+    return pa.schema([pa.field(name, arrow_type(hive_type)) for name, hive_type in table_columns(table_name)])
+
+
+def conform(value, hive_type):
+    """Coerce a JSON value the way JsonSerDe reads it: case-insensitive keys, objects in string columns kept as JSON"""
+    if value is None:
+        return None
+    if isinstance(hive_type, tuple):
+        kind, inner = hive_type
+        if kind == 'array':
+            values = value if isinstance(value, list) else [value]
+            return [conform(item, inner) for item in values]
+        if not isinstance(value, dict):
+            return None
+        lowered = {key.lower(): item for key, item in value.items()}
+        return {name.lower(): conform(lowered.get(name.lower()), field_type) for name, field_type in inner}
+    if hive_type == 'string':
+        if isinstance(value, str):
+            return value
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    try:
+        if hive_type in ('bigint', 'int'):
+            return int(value)
+        if hive_type == 'double':
+            return float(value)
+        if hive_type == 'boolean':
+            return value if isinstance(value, bool) else str(value).lower() == 'true'
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def conform_record(record, columns):
+    lowered = {key.lower(): value for key, value in record.items()}
+    return {name: conform(lowered.get(name.lower()), hive_type) for name, hive_type in columns}
+
+
+def read_manifest(location, key):
+    try:
+        return json.loads(read_object(location, key))
+    except Exception:
+        return None
+
+
+def compact_partition(source_location, target_location, source, partition, rows_per_file=500000, compression='snappy'):
+    """Rewrite one source/date partition as Parquet; returns (status, rows, files)"""
+    table_name = table_for_source(source)
+    input_prefix = f"{DATA_PREFIX}/{source}/{partition}/"
+    output_prefix = f"{COMPACTED_PREFIX}/{source}/{partition}/"
+    manifest_key = output_prefix + MANIFEST_FILE
+
+    objects = [[key, size] for key, size in list_objects(source_location, input_prefix)]
+    previous = read_manifest(target_location, manifest_key)
+    if previous and previous.get('objects') == objects and previous.get('compression') == compression:
+        return 'unchanged', previous.get('rows', 0), len(previous.get('files', []))
+
+    columns = table_columns(table_name)
+    rows = []
+    for key, _ in objects:
+        for record in iter_json_records(read_object(source_location, key)):
+            rows.append(conform_record(record, columns))
+    rows.sort(key=lambda row: row.get('time') or '')
+
+    schema = arrow_schema(table_name)
+    files = []
+    for index, start in enumerate(range(0, len(rows), rows_per_file)):
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows[start:start + rows_per_file], schema=schema), buffer, compression=compression)
+        file_key = f"{output_prefix}part-{index:05d}.{compression}.parquet"
+        write_object(target_location, file_key, buffer.getvalue())
+        files.append(file_key)
+
+    # Remove parts left over from a previous, larger compaction of this partition
+    for stale_key in set((previous or {}).get('files', [])) - set(files):
+        delete_object(target_location, stale_key)
+
+    manifest = {'objects': objects, 'files': files, 'rows': len(rows), 'compression': compression}
+    write_object(target_location, manifest_key, json.dumps(manifest).encode('utf-8'))
+    return 'compacted', len(rows), len(files)
+
+
+def compact(source_location, target_location, sources, date_from='', date_to='', rows_per_file=500000, compression='snappy', max_workers=4):
+    """Compact every partition of the given sources within [date_from, date_to] (yyyy/MM/dd, inclusive)"""
+    work = []
+    for source in sources:
+        for partition in list_partitions(source_location, f"{DATA_PREFIX}/{source}/"):
+            if (not date_from or partition >= date_from) and (not date_to or partition <= date_to):
+                work.append((source, partition))
+    print(f"Found {len(work)} partitions to check")
+
+    totals = {'compacted': 0, 'unchanged': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(compact_partition, source_location, target_location, source, partition, rows_per_file, compression): (source, partition)
+            for source, partition in work
+        }
+        for future in as_completed(futures):
+            source, partition = futures[future]
+            try:
+                status, rows, files = future.result()
+                totals[status] += 1
+                print(f"{status}: {source}/{partition} ({rows} rows, {files} files)")
+            except Exception as e:
+                totals['failed'] += 1
+                print(f"Error compacting {source}/{partition}: {e}")
+    print(f"\nCompaction complete: {totals['compacted']} compacted, {totals['unchanged']} unchanged, {totals['failed']} failed")
+    return totals
+
+
+def get_user_input():
+    source_location = input("Enter DataCollection location (s3://<DataCollectionBucket> or local directory): ").strip()
+    target_location = input(f"Enter output location, Hit enter to use default ({source_location}): ").strip() or source_location
+    sources = input(f"Enter comma-separated sources, Hit enter to use default ({','.join(all_sources())}): ").strip()
+    date_from = input("Enter first partition date (yyyy/MM/dd), Hit enter for all: ").strip()
+    date_to = input("Enter last partition date (yyyy/MM/dd), Hit enter for all: ").strip()
+    compression = input("Enter Parquet compression, Hit enter to use default (snappy): ").strip() or 'snappy'
+    source_list = [source.strip() for source in sources.split(',') if source.strip()] or all_sources()
+    return source_location, target_location, source_list, date_from, date_to, compression
+
+
+def main():
+    source_location, target_location, sources, date_from, date_to, compression = get_user_input()
+    unknown = [source for source in sources if not table_for_source(source)]
+    if unknown:
+        print(f"Unknown sources: {', '.join(unknown)}")
+        exit(1)
+    totals = compact(source_location, target_location, sources, date_from, date_to, compression=compression)
+    if totals['failed']:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import boto3
-import subprocess
 import datetime
 from botocore.exceptions import ClientError
 import os
+from utils.FunctionPackage import upload_package
+from utils.QuickSightDirectory import select_user
+from utils.S3Sync import sync
+from utils.StackDeployer import DEFAULT_MAX_PARALLEL, deploy_stacks, get_account_id, get_organization_id, parse_regions
 
 # Get Tag
 def tag():
@@ -12,10 +15,6 @@ def tag():
     return tag_key, tag_value
 
 
-# Call the tag function to get the tag key and value
-tag_key, tag_value = tag()
-
-
 #Get Current Region
 def get_default_region():
     # Get the default AWS region from the current session
@@ -24,19 +23,11 @@ def get_default_region():
     MemberRegionHealth = input(f"Enter member regions where you wish to receive events with comma seperated: ")
     return region, MemberRegionHealth
 
-#Get Current Account ID
-def get_account_id():
-    # Get the AWS account ID for Unique names
-    sts_client = boto3.client("sts")
-    account_id = sts_client.get_caller_identity().get("Account")
-    return account_id
-
 #Get current AWS Organization ID
 def get_organization_details():
     # Get the ID of the AWS organization for event bus
     AdditionalOrgs = ''
-    org_client = boto3.client('organizations')
-    OrgID = org_client.describe_organization()['Organization']['Id']
+    OrgID = get_organization_id()
     AdditionalOrgsRequired = ask_yes_no(f"You will get events from OrganizationId {OrgID}. Do you want to add additional Payers/Organization Ids")
     if AdditionalOrgsRequired:
         AdditionalOrgs = input(f"Enter organizations IDs with comma seperated: ")
@@ -47,7 +38,7 @@ def get_organization_details():
     return POrgID
 
 #Create or update user with bucket KMS
-def create_or_get_s3_bucket(account_id, region):
+def create_or_get_s3_bucket(account_id, region, tags):
     #create bucket or upload file if bucket is supplied by user
     bucket_name = input(f"Enter S3 bucket name for Primary Region (Hit enter to use default: awseventhealth-{account_id}-{region}): ") or f"awseventhealth-{account_id}-{region}"
     try:
@@ -77,7 +68,7 @@ def create_or_get_s3_bucket(account_id, region):
 
         # Add tags to the newly created bucket
         tagging = {
-            'TagSet': [{'Key': tag_key, 'Value': tag_value},]}
+            'TagSet': [{'Key': key, 'Value': value} for key, value in tags.items()]}
         
         s3_client.put_bucket_tagging(Bucket=bucket_name, Tagging=tagging)
         print(f"Tags added to bucket {bucket_name}")
@@ -87,46 +78,32 @@ def create_or_get_s3_bucket(account_id, region):
 #Upload CFN and Metadatafiles
 def sync_cfnfiles(bucket_name):
     #Sync cloudformation and metadata files
+    if sync("../../src/", bucket_name, "DataCollection-metadata"):
+        print("Error while syncing S3. Check if deployer role has required S3 and KMS permissions.")
+        exit(1)
+
+#Upload packaged Lambda functions, their key changes with the code
+def upload_functions(bucket_name):
     try:
-        aws_sync_command = f"aws s3 sync ../../src/ s3://{bucket_name}/DataCollection-metadata"
-        subprocess.call(aws_sync_command.split())
+        return upload_package(bucket_name)
     except ClientError as e:
-        print("Error while syncing S3. Check if deployer role has required S3 and KMS permissions.")
-        exit()
+        print("Error while uploading the Lambda package. Check if deployer role has required S3 and KMS permissions.")
+        print(e)
+        exit(1)
 
 #Get QuickSight Author User
 def get_quicksight_user(account_id, qsregion):
     #get quicksight user. ES user can have multiplenamespaces
     try:
-        quicksight_client = boto3.client('quicksight', region_name=qsregion)
-        response = quicksight_client.list_namespaces(AwsAccountId=account_id)
-        namespaces = [namespace['Name'] for namespace in response['Namespaces']]
-        qsusernames = []
-    except:
-        print("Error while listing namespaces. Check if QuickSight is an enterprise plan.")
-        exit()
-    try:
-        for namespace in namespaces:
-            response = quicksight_client.list_users(AwsAccountId=account_id, Namespace=namespace, MaxResults=100)
-            qsusernames.extend([user['Arn'] for user in response['UserList']])
+        quicksight_user = select_user(account_id, qsregion)
     except ClientError as q:
-        print("Wrong QuickSight Identity region.")
+        print("Error while listing QuickSight users. Check if QuickSight is an enterprise plan and the QuickSight Identity region is correct.")
         print(q)
-        exit()
-    print("\nAvailable QuickSight Users")
-    try:
-        for i, qsusername in enumerate(qsusernames, 1):
-            print("{}. {}".format(i, qsusername))
-        print()
-        while True:
-            quicksight_number = input("Enter the number corresponding to the QuickSight username from the list: ")
-            quicksight_user = qsusernames[int(quicksight_number) - 1] if quicksight_number.isdigit() and 1 <= int(quicksight_number) <= len(qsusernames) else None
-            if quicksight_user:
-                return quicksight_user
-            else: 
-                print("Invalid Option") 
-    except ClientError as q:
-        print("Something went wrong, Check Quicksight settings")
+        exit(1)
+    if not quicksight_user:
+        print("No QuickSight users found, Check Quicksight settings")
+        exit(1)
+    return quicksight_user
 
 #Get yes or no for modules
 def ask_yes_no(prompt):
@@ -138,6 +115,13 @@ def ask_yes_no(prompt):
             return False
         else:
             print("Invalid input. Please enter 'yes' or 'no'.")
+#Get a positive number, default on enter
+def ask_positive_int(prompt, default):
+    while True:
+        user_input = input(f"{prompt}, Hit enter to use default ({default}): ").strip() or str(default)
+        if user_input.isdigit() and int(user_input) > 0:
+            return int(user_input)
+        print("Invalid input. Please enter a positive number.")
 #Print pretty Box
 def print_boxed_text(text):
     lines = text.strip().split('\n')
@@ -171,15 +155,8 @@ def save_output_to_file(output):
     with open('utils/ParametersDataCollection.txt', 'w') as file:
         file.write(output + '\n')
 
-#deploy stack
-def deploy_stack(command):
-    try:
-        subprocess.call(command, shell=True)
-    except Exception as e:
-        print("An error occurred:", e)
-
 #User Input Data
-def get_user_input():
+def get_user_input(tags):
     SlackChannelId = "na"
     SlackWorkspaceId = "na"
     TeamId = "na"
@@ -193,7 +170,7 @@ def get_user_input():
     region, MemberRegionHealth = get_default_region()
     account_id = get_account_id()
     AWSOrganizationID = get_organization_details()
-    DataCollectionBucket, DataCollectionBucketKmsArn = create_or_get_s3_bucket(account_id, region)
+    DataCollectionBucket, DataCollectionBucketKmsArn = create_or_get_s3_bucket(account_id, region, tags)
 
     ResourcePrefix = input("Enter ResourcePrefix (Must be in lowercase), Hit enter to use default (heidi-): ") or "heidi-"
     ResourcePrefix = ResourcePrefix.lower()
@@ -314,6 +291,9 @@ def read_parameters(file_path):
 
 def setup():
     file_path = 'utils/ParametersDataCollection.txt'
+    # Asked here rather than at import so importing the module never prompts
+    tag_key, tag_value = tag()
+    tags = {tag_key: tag_value}
 
     if os.path.exists(file_path):
         with open(file_path, 'r') as file:
@@ -321,12 +301,12 @@ def setup():
             print_boxed_text(f"{file.read()}")
         reinput = ask_yes_no("Do you want to re-input parameters?")
         if reinput:
-            variables = get_user_input()
+            variables = get_user_input(tags)
             save_variables_to_file(variables)
         else:
             print("Skipping re-input. Using existing variables.")
     else:
-        variables = get_user_input()
+        variables = get_user_input(tags)
         save_variables_to_file(variables)
         print_boxed_text(f"\nDeployment will use these parameters. Update ./utils/ParametersDataCollection.txt file for additional changes")
         with open(file_path, 'r') as file:
@@ -336,49 +316,34 @@ def setup():
     parameters_dict = read_parameters('utils/ParametersDataCollection.txt')
     #sync cfn template files
     sync_cfnfiles(parameters_dict['DataCollectionBucket'])
+    functions_code_key = upload_functions(parameters_dict['DataCollectionBucket'])
 
     # Create or update the CloudFormation stack
     stack_name = f"{parameters_dict['ResourcePrefix']}{parameters_dict['DataCollectionAccountID']}-{parameters_dict['DataCollectionRegion']}"
 
-    parameters = f"AWSOrganizationID={parameters_dict['AWSOrganizationID']} " \
-                f"DataCollectionBucket={parameters_dict['DataCollectionBucket']} " \
-                f"DataCollectionBucketKmsArn={parameters_dict['DataCollectionBucketKmsArn']} " \
-                f"AthenaBucketKmsArn={parameters_dict['AthenaBucketKmsArn']} " \
-                f"QuickSightAnalysisAuthor={parameters_dict['QuickSightAnalysisAuthor']} " \
-                f"ResourcePrefix={parameters_dict['ResourcePrefix']} " \
-                f"SlackChannelId={parameters_dict['SlackChannelId']} " \
-                f"SlackWorkspaceId={parameters_dict['SlackWorkspaceId']} " \
-                f"TeamId={parameters_dict['TeamId']} " \
-                f"TeamsTenantId={parameters_dict['TeamsTenantId']} " \
-                f"TeamsChannelId={parameters_dict['TeamsChannelId']} " \
-                f"EnableHealthModule={parameters_dict['EnableHealthModule']} " \
-                f"EnableNotificationModule={parameters_dict['EnableNotificationModule']} " 
-    
-    #Update tags here
-    # Call the tag function to get the tag key and value
-    tags =  f"{tag_key}={tag_value} "
-                
-    command= f"sam deploy --stack-name {stack_name} --region {parameters_dict['DataCollectionRegion']} --parameter-overrides {parameters}\
-        --template-file ../DataCollectionModule/HeidiRoot.yaml --tags {tags} --capabilities CAPABILITY_NAMED_IAM --disable-rollback"
-    
-    #Deploy Stack
-    deploy_stack(command)
-
-    memberparameters = f"DataCollectionAccountID={parameters_dict['DataCollectionAccountID']} " \
-                f"DataCollectionRegion={parameters_dict['DataCollectionRegion']} " \
-                f"ResourcePrefix={parameters_dict['ResourcePrefix']} "
-
-    for memberregion in parameters_dict['MemberRegionHealth'].split(','):
-        # Check if the memberregion is not empty or just whitespace
-        if memberregion.strip():  # This ensures that empty strings or whitespace regions are ignored
-            Member_stack_name = f"{parameters_dict['ResourcePrefix']}HealthModule-{get_account_id()}-{memberregion}"
-            Membercommand = f"sam deploy --stack-name {Member_stack_name} --region {memberregion} --parameter-overrides {memberparameters} \
-                    --template-file ../HealthModule/HealthModuleCollectionSetup.yaml --tags {tags} --capabilities CAPABILITY_NAMED_IAM --disable-rollback"
-            
-            # Deploy the stack
-            deploy_stack(Membercommand)
-        else:
-            print(f"Skipping member Region deployment, no member Region supplied.")
+    parameters = {key: parameters_dict[key] for key in [
+        'AWSOrganizationID', 'DataCollectionBucket', 'DataCollectionBucketKmsArn', 'AthenaBucketKmsArn',
+        'QuickSightAnalysisAuthor', 'ResourcePrefix', 'SlackChannelId', 'SlackWorkspaceId', 'TeamId',
+        'TeamsTenantId', 'TeamsChannelId', 'EnableHealthModule', 'EnableNotificationModule']}
+    parameters['FunctionsCodeKey'] = functions_code_key
+
+    #Deploy Stack, nested templates are synced from src so they are part of the change detection
+    deploy_stacks({parameters_dict['DataCollectionRegion']: stack_name}, '../DataCollectionModule/HeidiRoot.yaml',
+                  parameters, tags, dependencies=['../**/*.yaml'])
+
+    memberparameters = {key: parameters_dict[key] for key in ['DataCollectionAccountID', 'DataCollectionRegion', 'ResourcePrefix']}
+
+    # Ignore empty strings or whitespace regions
+    member_regions = parse_regions(parameters_dict['MemberRegionHealth'])
+    if member_regions:
+        max_parallel = ask_positive_int("Enter how many member regions to deploy in parallel", DEFAULT_MAX_PARALLEL)
+        member_stacks = {
+            memberregion: f"{parameters_dict['ResourcePrefix']}HealthModule-{get_account_id()}-{memberregion}"
+            for memberregion in member_regions
+        }
+        deploy_stacks(member_stacks, '../HealthModule/HealthModuleCollectionSetup.yaml', memberparameters, tags, max_parallel=max_parallel)
+    else:
+        print(f"Skipping member Region deployment, no member Region supplied.")
 
 if __name__ == "__main__":
     setup()
@@ -0,0 +1,128 @@
+"""Read and write DataCollection objects on S3 or in a local directory.
+
+A location is either an s3://bucket[/prefix] URI or a local directory laid out
+like the DataCollection bucket (DataCollection-data/<source>/<yyyy>/<MM>/<dd>/...).
+Keys are always relative to the location and use '/' separators.
+"""
+import gzip
+import json
+import os
+import threading
+
+import boto3
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """Return the shared S3 client, created on first use"""
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.client('s3')
+        return _s3_client
+
+
+def is_s3(location):
+    return location.startswith('s3://')
+
+
+def split_s3_uri(uri):
+    """Split s3://bucket/prefix into (bucket, prefix) without trailing slash"""
+    bucket, _, prefix = uri[len('s3://'):].partition('/')
+    return bucket, prefix.strip('/')
+
+
+def _s3_key(location, key):
+    bucket, prefix = split_s3_uri(location)
+    return bucket, f"{prefix}/{key}" if prefix else key
+
+
+def list_objects(location, prefix=''):
+    """Yield (key, size) for every object below prefix, sorted by key"""
+    if is_s3(location):
+        bucket, base = split_s3_uri(location)
+        full_prefix = '/'.join(part for part in (base, prefix) if part)
+        paginator = get_s3_client().get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=full_prefix):
+            for item in page.get('Contents', []):
+                key = item['Key'][len(base) + 1:] if base else item['Key']
+                if not key.endswith('/'):
+                    yield key, item['Size']
+        return
+
+    root = os.path.join(location, *prefix.split('/')) if prefix else location
+    if os.path.isfile(root):
+        yield prefix, os.path.getsize(root)
+        return
+    found = []
+    for directory, _, files in os.walk(root):
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            key = os.path.relpath(path, location).replace(os.sep, '/')
+            found.append((key, os.path.getsize(path)))
+    yield from sorted(found)
+
+
+def list_partitions(location, prefix):
+    """Return the sorted yyyy/MM/dd partitions found directly below prefix"""
+    partitions = set()
+    for key, _ in list_objects(location, prefix):
+        parts = key[len(prefix):].strip('/').split('/')
+        if len(parts) >= 4:
+            partitions.add('/'.join(parts[:3]))
+    return sorted(partitions)
+
+
+def read_object(location, key):
+    """Return the object body, transparently decompressing .gz objects"""
+    if is_s3(location):
+        bucket, s3_key = _s3_key(location, key)
+        body = get_s3_client().get_object(Bucket=bucket, Key=s3_key)['Body'].read()
+    else:
+        with open(os.path.join(location, *key.split('/')), 'rb') as file:
+            body = file.read()
+    if key.endswith('.gz'):
+        body = gzip.decompress(body)
+    return body
+
+
+def write_object(location, key, body):
+    """Write body (bytes) to key, creating local directories as needed"""
+    if is_s3(location):
+        bucket, s3_key = _s3_key(location, key)
+        get_s3_client().put_object(Bucket=bucket, Key=s3_key, Body=body)
+        return
+    path = os.path.join(location, *key.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(body)
+
+
+def delete_object(location, key):
+    if is_s3(location):
+        bucket, s3_key = _s3_key(location, key)
+        get_s3_client().delete_object(Bucket=bucket, Key=s3_key)
+        return
+    path = os.path.join(location, *key.split('/'))
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def iter_json_records(body):
+    """Yield the JSON records of a Firehose object.
+
+    Records are newline delimited, but objects written before the delimiter
+    processor was enabled hold concatenated documents, so decode sequentially.
+    """
+    text = body.decode('utf-8')
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            return
+        record, position = decoder.raw_decode(text, position)
+        yield record
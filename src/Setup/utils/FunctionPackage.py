@@ -0,0 +1,50 @@
+"""Build and upload the zip of the packaged Lambda functions in src/HealthModule/functions.
+
+The zip is built deterministically (sorted entries, fixed timestamps and
+permissions) and named after its SHA-256. An unchanged package keeps its key, so
+it is not uploaded again and the functions are not updated; a changed package
+gets a new key, which CloudFormation deploys.
+"""
+import hashlib
+import io
+import os
+import zipfile
+
+import boto3
+from botocore.exceptions import ClientError
+
+FUNCTIONS_DIR = "../HealthModule/functions"
+PACKAGE_PREFIX = "DataCollection-functions"
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+def build_package(source=FUNCTIONS_DIR):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as package:
+        for name in sorted(os.listdir(source)):
+            if not name.endswith('.py'):
+                continue
+            info = zipfile.ZipInfo(name, ZIP_TIMESTAMP)
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(os.path.join(source, name), 'rb') as f:
+                package.writestr(info, f.read())
+    return buffer.getvalue()
+
+
+def package_key(body):
+    return f"{PACKAGE_PREFIX}/heidi-functions-{hashlib.sha256(body).hexdigest()[:16]}.zip"
+
+
+def upload_package(bucket_name, source=FUNCTIONS_DIR):
+    """Upload the package unless an object with its key exists, return the key"""
+    body = build_package(source)
+    key = package_key(body)
+    s3_client = boto3.client('s3')
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=key)
+        print(f"Lambda package {key} is up to date")
+    except ClientError:
+        s3_client.put_object(Bucket=bucket_name, Key=key, Body=body)
+        print(f"Uploaded Lambda package {key}")
+    return key
@@ -0,0 +1,110 @@
+"""Column definitions of the Heidi Glue tables, shared by the Setup utilities.
+
+Keep these in sync with GlueHealthTable (HealthModule/HealthModuleDataSetSetup.yaml)
+and GlueTableTaginfo (DataCollectionModule/DataCollectionModule.yaml).
+"""
+
+# Firehose writes every record under DataCollection-data/<source>/<yyyy>/<MM>/<dd>/
+DATA_PREFIX = "DataCollection-data"
+COMPACTED_PREFIX = "DataCollection-compacted"
+
+ENVELOPE_COLUMNS = [
+    ('version', 'string'),
+    ('id', 'string'),
+    ('detail-type', 'string'),
+    ('source', 'string'),
+    ('account', 'string'),
+    ('time', 'string'),
+    ('region', 'string'),
+    ('resources', 'array<string>'),
+]
+
+HEALTH_EVENT_DETAIL = (
+    "struct<eventarn:string,affectedAccount:string,service:string,eventscopecode:string,communicationid:string,"
+    "lastupdatedtime:string,eventregion:string,eventtypecode:string,eventtypecategory:string,statusCode:string,"
+    "starttime:string,endtime:string,eventdescription:array<struct<language:string,latestdescription:string>>,"
+    "eventMetadata:string,affectedentities:array<struct<entityvalue:string,status:string,entityarn:string,"
+    "entityaz:string,entitytags:array<struct<value:string,key:string>>>>,starttimeepoch:bigint,endtimeepoch:bigint,"
+    "lastupdatedtimeepoch:bigint,eventduration:bigint,plannedlifecycleevent:string>"
+)
+
+# Added by the Firehose account enrichment processor when enabled
+ACCOUNT_INFO = "struct<name:string,oupath:string,tag:string,tags:array<struct<key:string,value:string>>>"
+
+TAGINFO_DETAIL = "struct<entityarn:string,tags:array<struct<entitykey:string,entityvalue:string>>>"
+
+TABLES = {
+    'awshealthevent': {
+        'sources': ['heidi.health', 'aws.health', 'awshealthtest'],
+        'columns': ENVELOPE_COLUMNS + [('accountinfo', ACCOUNT_INFO), ('detail', HEALTH_EVENT_DETAIL)],
+    },
+    'taginfo': {
+        'sources': ['heidi.taginfo'],
+        'columns': ENVELOPE_COLUMNS + [('detail', TAGINFO_DETAIL)],
+    },
+}
+
+
+def table_for_source(source):
+    """Return the Glue table name holding records of the given source partition"""
+    for table_name, table in TABLES.items():
+        if source in table['sources']:
+            return table_name
+    return None
+
+
+def all_sources():
+    """Return every source partition known to the Glue tables"""
+    return [source for table in TABLES.values() for source in table['sources']]
+
+
+def extended_partition(record, account_buckets):
+    """Return the <event_category>/<account_bucket> path Firehose adds below the date with EnableExtendedPartitioning.
+
+    Mirrors the MetadataExtractionQuery of DataCollectionKinesisFirehose.
+    """
+    detail = record.get('detail') if isinstance(record.get('detail'), dict) else {}
+    category = detail.get('eventTypeCategory')
+    account = next((value for value in (detail.get('affectedAccount'), record.get('account')) if value is not None), '')
+    bucket = int(account) % account_buckets if isinstance(account, str) and account.isdigit() and account.isascii() else 0
+    return f"{'none' if category is None else category}/{bucket}"
+
+
+def parse_hive_type(type_string):
+    """Parse a Hive type string into nested tuples.
+
+    Primitives are returned as their name, arrays as ('array', element) and
+    structs as ('struct', [(field, type), ...]).
+    """
+    parsed, position = _parse_type(type_string.replace(' ', ''), 0)
+    if position != len(type_string.replace(' ', '')):
+        raise ValueError(f"Unexpected trailing characters in type: {type_string}")
+    return parsed
+
+
+def _parse_type(text, position):
+    if text.startswith('array<', position):
+        element, position = _parse_type(text, position + len('array<'))
+        return ('array', element), _expect(text, position, '>')
+    if text.startswith('struct<', position):
+        position += len('struct<')
+        fields = []
+        while True:
+            colon = text.index(':', position)
+            field_name = text[position:colon]
+            field_type, position = _parse_type(text, colon + 1)
+            fields.append((field_name, field_type))
+            if text[position] == ',':
+                position += 1
+                continue
+            return ('struct', fields), _expect(text, position, '>')
+    end = position
+    while end < len(text) and text[end] not in ',>':
+        end += 1
+    return text[position:end], end
+
+
+def _expect(text, position, character):
+    if position >= len(text) or text[position] != character:
+        raise ValueError(f"Expected '{character}' at position {position} in type: {text}")
+    return position + 1
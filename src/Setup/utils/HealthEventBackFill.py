@@ -1,16 +1,21 @@
-import boto3
 import json
 from datetime import datetime
-
-DataCollectionAccountID = input("Enter DataCollection Account ID: ")
-DataCollectionRegion = input("Enter DataCollection region: ")
-ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
-
-health_client = boto3.client('health', 'us-east-1')
-eventbridge_client = boto3.client('events',DataCollectionRegion)
-EventBusArnVal = f"arn:aws:events:{DataCollectionRegion}:{DataCollectionAccountID}:event-bus/{ResourcePrefix}DataCollectionBus-{DataCollectionAccountID}"
-
-def get_events():
+from ClientPool import HEALTH_REGION, event_bus_arn, get_client, get_event_bus_client, put_events
+from HealthEventFormat import add_canonical_fields, format_health_time
+from HealthFilter import account_filter, describe, get_filter_input
+from RawResponseStore import is_current, latest_records, save_record, stored_versions
+
+# Raw response store scope of the events of the account view
+ACCOUNT_SCOPE = "account"
+
+def get_user_input():
+    DataCollectionAccountID = input("Enter DataCollection Account ID: ")
+    DataCollectionRegion = input("Enter DataCollection region: ")
+    ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+    return DataCollectionAccountID, DataCollectionRegion, ResourcePrefix
+
+def get_events(event_filter=None):
+    health_client = get_client('health', HEALTH_REGION)
     events = []
     next_token = None
     try:
@@ -18,7 +23,7 @@ def get_events():
             kwargs = {}
             if next_token and len(next_token) >= 4:
                 kwargs['nextToken'] = next_token
-            events_response = health_client.describe_events(filter={}, **kwargs)
+            events_response = health_client.describe_events(filter=event_filter or {}, **kwargs)
             events += events_response['events']
             if 'nextToken' in events_response:
                 next_token = events_response['nextToken']
@@ -34,34 +39,38 @@ def get_event_data(event_details, event_description,event_metadata):
         'eventArn': event_details['arn'],
         'eventRegion': event_details.get('region', ''),
         'eventTypeCode': event_details.get('eventTypeCode', ''),
-        'startTime': event_details.get('startTime').strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'startTime': format_health_time(event_details.get('startTime')),
         'eventDescription': [{'latestDescription': event_description['latestDescription']}],
         'eventMetadata': event_metadata
         }
     # Check if 'timefield' exists in event_details before including it in event_data
     if 'endTime' in event_details:
-        event_data['endTime'] = event_details['endTime'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        event_data['endTime'] = format_health_time(event_details['endTime'])
 
     if 'lastUpdatedTime' in event_details:
-        event_data['lastUpdatedTime'] = event_details['lastUpdatedTime'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        event_data['lastUpdatedTime'] = format_health_time(event_details['lastUpdatedTime'])
+
+    # Typed copies of the times, duration and lifecycle flag for the Glue schema
+    add_canonical_fields(event_data, event_details)
 
     event_data.update((key, value) for key, value in event_details.items() if key not in event_data)
     print(event_data)
 
     return event_data
 
+def event_entry(event_data, EventBusArn):
+    return {
+        'Source': 'heidi.health',
+        'DetailType': 'awshealthtest',
+        'Detail': json.dumps(event_data),
+        'EventBusName': EventBusArn
+    }
+
 def send_event_defaultBus(event_data, EventBusArn):
-    # Send the event to EventBridge
-    eventbridge_client.put_events(
-        Entries=[
-            {
-                'Source': 'heidi.health',
-                'DetailType': 'awshealthtest',
-                'Detail': json.dumps(event_data),
-                'EventBusName': EventBusArn
-            }
-        ]
-    )
+    # Send the event to EventBridge, a rejected entry raises so the event is not stored as sent
+    response = get_event_bus_client(EventBusArn).put_events(Entries=[event_entry(event_data, EventBusArn)])
+    if response.get('FailedEntryCount'):
+        raise RuntimeError(f"EventBridge rejected event {event_data['eventArn']}: {response['Entries'][0].get('ErrorMessage')}")
 
 # def backfill():
 #     events = get_events()
@@ -89,64 +98,116 @@ def send_event_defaultBus(event_data, EventBusArn):
 #     except Exception as e:
 #         print(e)
 
-def backfill():
-    events = get_events()
-    EventBusArn = EventBusArnVal
+def fetch_event(health_client, awsevent):
+    """Return the raw responses of an event: its summary, details and every affected entity"""
+    # Fetch event details
+    event_details_response = health_client.describe_event_details(eventArns=[awsevent['arn']])
+    
+    # Pagination setup for affected entities
+    entities = []
+    next_token = None
+    
+    while True:
+        # Fetch affected entities with optional pagination token
+        params = {
+            'filter': {'eventArns': [awsevent['arn']]}
+        }
+        if next_token:
+            params['nextToken'] = next_token
+
+        event_affected_response = health_client.describe_affected_entities(**params)
+        entities.extend(event_affected_response.get('entities', []))
+        
+        # Check for pagination token
+        next_token = event_affected_response.get('nextToken')
+        if not next_token:
+            break  # Exit loop if no more pages
+
+    return {'event': awsevent, 'successfulSet': event_details_response.get('successfulSet', []), 'entities': entities}
+
+def derive_event(raw):
+    """Build the event data of the raw responses of fetch_event, None when the details are missing"""
+    # Extract event details
+    successful_set = raw['successfulSet']
+    if not successful_set:
+        return None
+    
+    # Copied, so the raw record is stored as the API returned it
+    event_details = dict(successful_set[0].get('event', {}))
+    if not event_details:
+        return None
+
+    # Append accumulated affected entities
+    event_details['affectedEntities'] = [
+        {'entityValue': entity.get('entityValue', 'UNKNOWN'), 'status': entity.get('statusCode', 'UNKNOWN')}
+        for entity in raw['entities']
+    ]
+
+    # Extract event description
+    event_description = successful_set[0].get('eventDescription', '')
+
+    # Extract event Metadata
+    event_metadata = successful_set[0].get('eventMetadata', '')
+
+    return get_event_data(event_details, event_description, event_metadata)
+
+def backfill(EventBusArn, selected=None, store=None):
+    """Send the events of the account matching the HealthFilter selection to the DataCollection bus, return how many were sent.
+
+    With a RawResponseStore location, the raw responses are saved there and events
+    whose lastUpdatedTime is already stored are skipped.
+    """
+    health_client = get_client('health', HEALTH_REGION)
+    print(f"Backfilling {describe(selected)}")
+    events = get_events(account_filter(selected or {}))
+    versions = stored_versions(store) if store else {}
+    sent = 0
+    unchanged = 0
 
     for awsevent in events:
         try:
-            # Fetch event details
-            event_details_response = health_client.describe_event_details(eventArns=[awsevent['arn']])
-            
-            # Pagination setup for affected entities
-            affected_entities = []
-            next_token = None
-            
-            while True:
-                # Fetch affected entities with optional pagination token
-                params = {
-                    'filter': {'eventArns': [awsevent['arn']]}
-                }
-                if next_token:
-                    params['nextToken'] = next_token
-
-                event_affected_response = health_client.describe_affected_entities(**params)
-                
-                # Process entities
-                entities = event_affected_response.get('entities', [])
-                for entity in entities:
-                    entity_value = entity.get('entityValue', 'UNKNOWN')
-                    status_code = entity.get('statusCode', 'UNKNOWN')
-                    affected_entities.append({'entityValue': entity_value, 'status': status_code})
-                
-                # Check for pagination token
-                next_token = event_affected_response.get('nextToken')
-                if not next_token:
-                    break  # Exit loop if no more pages
-
-            # Extract event details
-            successful_set = event_details_response.get('successfulSet', [])
-            if not successful_set:
-                continue
-            
-            event_details = successful_set[0].get('event', {})
-            if not event_details:
+            if store and is_current(versions, awsevent['arn'], ACCOUNT_SCOPE, awsevent.get('lastUpdatedTime')):
+                unchanged += 1
                 continue
-
-            # Append accumulated affected entities
-            event_details['affectedEntities'] = affected_entities
-
-            # Extract event description
-            event_description = successful_set[0].get('eventDescription', '')
-
-            # Extract event Metadata
-            event_metadata = successful_set[0].get('eventMetadata', '')
+            raw = fetch_event(health_client, awsevent)
 
             # Prepare and send event data
-            event_data = get_event_data(event_details, event_description,event_metadata)
+            event_data = derive_event(raw)
+            if not event_data:
+                continue
             send_event_defaultBus(event_data, EventBusArn)
+            sent += 1
+            # Stored once delivered, so an event that failed to send is fetched again by the next run
+            if store:
+                save_record(store, awsevent['arn'], ACCOUNT_SCOPE, awsevent.get('lastUpdatedTime'), raw)
 
         except Exception as e:
             print(f"Error occurred: {e}")
 
-backfill()
+    if store:
+        print(f"Skipped {unchanged} events not updated since they were stored")
+    return sent
+
+def rederive(EventBusArn, store):
+    """Rebuild the events of the store and send them without calling the Health API, return how many were sent"""
+    entries = []
+    for records in latest_records(store).values():
+        event_data = derive_event(records[ACCOUNT_SCOPE]) if ACCOUNT_SCOPE in records else None
+        if event_data:
+            entries.append(event_entry(event_data, EventBusArn))
+    failed = put_events(EventBusArn, entries)
+    print(f"Rederived {len(entries)} events from {store}, {failed} failed to send")
+    return len(entries) - failed
+
+def main():
+    DataCollectionAccountID, DataCollectionRegion, ResourcePrefix = get_user_input()
+    EventBusArn = event_bus_arn(DataCollectionAccountID, DataCollectionRegion, ResourcePrefix)
+    store = input("Enter raw response store (s3://<bucket>/<prefix> or local directory), Hit enter to not store responses: ").strip()
+    if store and input("Rebuild events from the store instead of calling the Health API (yes/no), Hit enter to use default (no): ").strip().lower() == 'yes':
+        rederive(EventBusArn, store)
+        return
+    selected = get_filter_input()
+    backfill(EventBusArn, selected, store or None)
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,50 @@
-import boto3
 import json
 import logging
 import os
 from datetime import datetime
+from ClientPool import HEALTH_REGION, event_bus_arn, get_client, get_event_bus_client, put_events
+from HealthEventFormat import add_canonical_fields, format_health_time
+from HealthFilter import describe, get_filter_input, organization_filter
+from RawResponseStore import is_current, latest_records, save_record, stored_versions
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-DataCollectionAccountID = input("Enter DataCollection Account ID: ")
-DataCollectionRegion = input("Enter DataCollection region: ")
-ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+# Raw response store scopes: the event with its affected accounts, and the event without account information
+ORGANIZATION_SCOPE = "organization"
+NO_ACCOUNT_SCOPE = "none"
 
-# Checkpoint file path
-CHECKPOINT_FILE = f"checkpoint_{DataCollectionAccountID}.json"
+def get_user_input():
+    DataCollectionAccountID = input("Enter DataCollection Account ID: ")
+    DataCollectionRegion = input("Enter DataCollection region: ")
+    ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+    return DataCollectionAccountID, DataCollectionRegion, ResourcePrefix
 
-health_client = boto3.client('health', 'us-east-1')
-eventbridge_client = boto3.client('events', DataCollectionRegion)
-EventBusArnVal = f"arn:aws:events:{DataCollectionRegion}:{DataCollectionAccountID}:event-bus/{ResourcePrefix}DataCollectionBus-{DataCollectionAccountID}"
+def checkpoint_path(account_id, checkpoint_dir='.'):
+    """Checkpoint file path"""
+    return os.path.join(checkpoint_dir, f"checkpoint_{account_id}.json")
 
-def save_checkpoint(next_token=None, processed_events=0):
+def save_checkpoint(checkpoint_file, next_token=None, processed_events=0, selection='all events'):
     """Save checkpoint to file"""
     checkpoint = {
         'next_token': next_token,
+        'selection': selection,
         'processed_events': processed_events,
         'timestamp': datetime.now().isoformat()
     }
     try:
-        with open(CHECKPOINT_FILE, 'w') as f:
+        with open(checkpoint_file, 'w') as f:
             json.dump(checkpoint, f)
         logger.info(f"Checkpoint saved: {processed_events} events processed, next_token: {next_token[:20] if next_token else 'None'}...")
     except Exception as e:
         logger.error(f"Error saving checkpoint: {e}")
 
-def load_checkpoint():
+def load_checkpoint(checkpoint_file):
     """Load checkpoint from file"""
-    if os.path.exists(CHECKPOINT_FILE):
+    if os.path.exists(checkpoint_file):
         try:
-            with open(CHECKPOINT_FILE, 'r') as f:
+            with open(checkpoint_file, 'r') as f:
                 checkpoint = json.load(f)
             logger.info(f"Checkpoint loaded: {checkpoint['processed_events']} events already processed")
             return checkpoint
@@ -46,22 +53,23 @@ def load_checkpoint():
             return None
     return None
 
-def clear_checkpoint():
+def clear_checkpoint(checkpoint_file):
     """Remove checkpoint file after successful completion"""
-    if os.path.exists(CHECKPOINT_FILE):
+    if os.path.exists(checkpoint_file):
         try:
-            os.remove(CHECKPOINT_FILE)
+            os.remove(checkpoint_file)
             logger.info("Checkpoint file removed after successful completion")
         except Exception as e:
             logger.error(f"Error removing checkpoint file: {e}")
 
-def get_organization_events_page(next_token=None):
-    """Retrieve one page of organization health events"""
+def get_organization_events_page(next_token=None, event_filter=None):
+    """Retrieve one page of organization health events matching event_filter"""
+    health_client = get_client('health', HEALTH_REGION)
     try:
         kwargs = {'maxResults': 100}
         if next_token and len(next_token) >= 4:
             kwargs['nextToken'] = next_token
-        events_response = health_client.describe_events_for_organization(filter={}, **kwargs)
+        events_response = health_client.describe_events_for_organization(filter=event_filter or {}, **kwargs)
         events = events_response.get('events', [])
         new_next_token = events_response.get('nextToken')
         logger.info(f"Retrieved {len(events)} events in this page")
@@ -72,6 +80,7 @@ def get_organization_events_page(next_token=None):
 
 def describe_health_events_details_for_organization(item, account_id):
     """Get event details for a specific account in the organization"""
+    health_client = get_client('health', HEALTH_REGION)
     try:
         response = health_client.describe_event_details_for_organization(
             organizationEventDetailFilters=[{
@@ -86,6 +95,7 @@ def describe_health_events_details_for_organization(item, account_id):
 
 def describe_affected_accounts(item):
     """Get all affected accounts for an organization event"""
+    health_client = get_client('health', HEALTH_REGION)
     try:
         affected_accounts = []
         next_token = None
@@ -112,6 +122,7 @@ def describe_affected_accounts(item):
 
 def describe_affected_entities(item, account_id):
     """Get all affected entities for a specific account"""
+    health_client = get_client('health', HEALTH_REGION)
     try:
         entities = []
         next_token = None
@@ -146,7 +157,7 @@ def get_event_data(event_details, event_description, event_metadata, affected_en
         'eventArn': event_details['arn'],
         'eventRegion': event_details.get('region', ''),
         'eventTypeCode': event_details.get('eventTypeCode', ''),
-        'startTime': event_details.get('startTime').strftime('%a, %d %b %Y %H:%M:%S GMT'),
+        'startTime': format_health_time(event_details.get('startTime')),
         'eventDescription': [{'latestDescription': event_description.get('latestDescription', '')}],
         'eventMetadata': event_metadata
     }
@@ -161,10 +172,13 @@ def get_event_data(event_details, event_description, event_metadata, affected_en
     
     # Add optional time fields
     if 'endTime' in event_details:
-        event_data['endTime'] = event_details['endTime'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        event_data['endTime'] = format_health_time(event_details['endTime'])
     
     if 'lastUpdatedTime' in event_details:
-        event_data['lastUpdatedTime'] = event_details['lastUpdatedTime'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        event_data['lastUpdatedTime'] = format_health_time(event_details['lastUpdatedTime'])
+    
+    # Typed copies of the times, duration and lifecycle flag for the Glue schema
+    add_canonical_fields(event_data, event_details)
     
     # Add any additional fields from event_details
     event_data.update((key, value) for key, value in event_details.items() if key not in event_data)
@@ -172,29 +186,77 @@ def get_event_data(event_details, event_description, event_metadata, affected_en
     logger.info(f"Processed event {event_details['arn']} for account {account_id}")
     return event_data
 
+def fetch_account_event(item, account_id=None):
+    """Return the raw details and affected entities of an event for one account, or without account"""
+    if account_id:
+        event_details_response = describe_health_events_details_for_organization(item, account_id)
+        entities = describe_affected_entities(item, account_id) if event_details_response.get('successfulSet') else []
+    else:
+        # Get event details without account filter
+        event_details_response = get_client('health', HEALTH_REGION).describe_event_details_for_organization(
+            organizationEventDetailFilters=[{'eventArn': item['arn']}]
+        )
+        entities = []
+    return {'successfulSet': event_details_response.get('successfulSet', []), 'entities': entities}
+
+def derive_account_event(raw, account_id=None):
+    """Build the event data of the raw responses of fetch_account_event, None when the details are missing"""
+    successful_set = raw['successfulSet']
+    if not successful_set:
+        return None
+    
+    event_details = successful_set[0].get('event', {})
+    if not event_details:
+        return None
+    
+    event_description = successful_set[0].get('eventDescription', {})
+    event_metadata = successful_set[0].get('eventMetadata', {})
+    affected_entities = [
+        {'entityValue': entity.get('entityValue', 'UNKNOWN'), 'status': entity.get('statusCode', 'UNKNOWN')}
+        for entity in raw['entities']
+    ]
+    return get_event_data(event_details, event_description, event_metadata, affected_entities, account_id)
+
+def event_entry(event_data, EventBusArn):
+    return {
+        'Source': 'heidi.health',
+        'DetailType': 'awshealthtest',
+        'Detail': json.dumps(event_data, default=str),
+        'EventBusName': EventBusArn
+    }
+
 def send_event_to_eventbridge(event_data, EventBusArn):
-    """Send the event to EventBridge"""
+    """Send the event to EventBridge, returns whether it was accepted"""
     try:
-        eventbridge_client.put_events(
-            Entries=[{
-                'Source': 'heidi.health',
-                'DetailType': 'awshealthtest',
-                'Detail': json.dumps(event_data, default=str),
-                'EventBusName': EventBusArn
-            }]
-        )
+        response = get_event_bus_client(EventBusArn).put_events(Entries=[event_entry(event_data, EventBusArn)])
+        if response.get('FailedEntryCount'):
+            logger.error(f"EventBridge rejected event {event_data['eventArn']}: {response['Entries'][0].get('ErrorMessage')}")
+            return False
         logger.info(f"Sent event to EventBridge: {event_data['eventArn']}")
+        return True
     except Exception as e:
         logger.error(f"Error sending event to EventBridge: {e}")
+        return False
 
-def backfill():
-    """Main backfill function for organization health events"""
-    EventBusArn = EventBusArnVal
+def backfill(EventBusArn, checkpoint_file, selected=None, store=None):
+    """Main backfill function for organization health events matching the HealthFilter selection, returns the number of events sent.
+
+    With a RawResponseStore location, the raw responses are saved there and events,
+    or accounts of an event, whose lastUpdatedTime is already stored are skipped.
+    """
+    event_filter = organization_filter(selected or {})
+    selection = describe(selected)
+    logger.info(f"Backfilling {selection}")
     
     total_events_processed = 0
+    versions = stored_versions(store) if store else {}
+    unchanged = 0
     
-    # Load checkpoint if exists
-    checkpoint = load_checkpoint()
+    # Load checkpoint if exists, a next_token is only valid for the filter it was returned for
+    checkpoint = load_checkpoint(checkpoint_file)
+    if checkpoint and checkpoint.get('selection', 'all events') != selection:
+        logger.info("Checkpoint was saved for another selection, starting from the beginning")
+        checkpoint = None
     next_token = checkpoint.get('next_token') if checkpoint else None
     total_events_processed = checkpoint.get('processed_events', 0) if checkpoint else 0
     
@@ -203,7 +265,7 @@ def backfill():
     
     # Process events page by page
     while True:
-        events, new_next_token = get_organization_events_page(next_token)
+        events, new_next_token = get_organization_events_page(next_token, event_filter)
         
         if not events:
             logger.info("No more events to process")
@@ -212,86 +274,64 @@ def backfill():
         # Process all events in this page
         for awsevent in events:
             try:
+                if store and is_current(versions, awsevent['arn'], ORGANIZATION_SCOPE, awsevent.get('lastUpdatedTime')):
+                    unchanged += 1
+                    continue
+
                 # Get all affected accounts for this event
                 affected_accounts = describe_affected_accounts(awsevent)
+                account_filtered = bool(affected_accounts and event_filter.get('awsAccountIds'))
+                if account_filtered:
+                    # Only send the selected accounts of events that also affect others
+                    affected_accounts = [account_id for account_id in affected_accounts if account_id in event_filter['awsAccountIds']]
+                    if not affected_accounts:
+                        continue
                 
                 if not affected_accounts:
                     logger.warning(f"No affected accounts found for event {awsevent['arn']}, processing without account")
-                    # Process event without account information
-                    try:
-                        # Get event details without account filter
-                        event_details_response = health_client.describe_event_details_for_organization(
-                            organizationEventDetailFilters=[{'eventArn': awsevent['arn']}]
-                        )
-                        
-                        successful_set = event_details_response.get('successfulSet', [])
-                        if successful_set:
-                            event_details = successful_set[0].get('event', {})
-                            if event_details:
-                                event_description = successful_set[0].get('eventDescription', {})
-                                event_metadata = successful_set[0].get('eventMetadata', {})
-                                
-                                # Prepare and send event data without account
-                                event_data = get_event_data(
-                                    event_details, 
-                                    event_description, 
-                                    event_metadata, 
-                                    [],
-                                    None
-                                )
-                                send_event_to_eventbridge(event_data, EventBusArn)
-                                total_events_processed += 1
-                    except Exception as e:
-                        logger.error(f"Error processing event without account {awsevent['arn']}: {e}")
-                    continue
                 
-                # Process each affected account
-                for account_id in affected_accounts:
+                # Process each affected account, or the event without account information
+                failed = False
+                for account_id in affected_accounts or [None]:
                     try:
-                        # Get event details for this account
-                        event_details_response = describe_health_events_details_for_organization(awsevent, account_id)
-                        
-                        successful_set = event_details_response.get('successfulSet', [])
-                        if not successful_set:
-                            logger.warning(f"No successful set for event {awsevent['arn']} and account {account_id}")
+                        if store and is_current(versions, awsevent['arn'], account_id or NO_ACCOUNT_SCOPE, awsevent.get('lastUpdatedTime')):
                             continue
-                        
-                        event_details = successful_set[0].get('event', {})
-                        if not event_details:
+                        raw = fetch_account_event(awsevent, account_id)
+                        if not raw['successfulSet']:
+                            # Not stored, the next run asks for the details again
+                            failed = True
+                            logger.warning(f"No successful set for event {awsevent['arn']} and account {account_id}")
                             continue
                         
-                        event_description = successful_set[0].get('eventDescription', {})
-                        event_metadata = successful_set[0].get('eventMetadata', {})
-                        
-                        # Get affected entities for this account
-                        entities = describe_affected_entities(awsevent, account_id)
-                        affected_entities = []
-                        for entity in entities:
-                            entity_value = entity.get('entityValue', 'UNKNOWN')
-                            status_code = entity.get('statusCode', 'UNKNOWN')
-                            affected_entities.append({'entityValue': entity_value, 'status': status_code})
-                        
                         # Prepare and send event data
-                        event_data = get_event_data(
-                            event_details, 
-                            event_description, 
-                            event_metadata, 
-                            affected_entities,
-                            account_id
-                        )
-                        send_event_to_eventbridge(event_data, EventBusArn)
+                        event_data = derive_account_event(raw, account_id)
+                        if not event_data:
+                            continue
+                        if not send_event_to_eventbridge(event_data, EventBusArn):
+                            failed = True
+                            continue
                         total_events_processed += 1
+                        # Stored once delivered, so an account that failed to send is fetched again by the next run
+                        if store:
+                            save_record(store, awsevent['arn'], account_id or NO_ACCOUNT_SCOPE, awsevent.get('lastUpdatedTime'), raw)
                         
                     except Exception as e:
+                        failed = True
                         logger.error(f"Error processing account {account_id} for event {awsevent['arn']}: {e}")
                         continue
+                
+                # Stored last, so an event with a failed account is fetched again by the next run. A run
+                # narrowed to some accounts does not mark the event current for the accounts it left out.
+                if store and not failed and not account_filtered:
+                    save_record(store, awsevent['arn'], ORGANIZATION_SCOPE, awsevent.get('lastUpdatedTime'),
+                                {'event': awsevent, 'affectedAccounts': affected_accounts})
             
             except Exception as e:
                 logger.error(f"Error processing event {awsevent.get('arn', 'UNKNOWN')}: {e}")
                 continue
         
         # Save checkpoint after processing this page
-        save_checkpoint(new_next_token, total_events_processed)
+        save_checkpoint(checkpoint_file, new_next_token, total_events_processed, selection)
         
         # Move to next page
         if not new_next_token:
@@ -300,9 +340,37 @@ def backfill():
         
         next_token = new_next_token
     
+    if store:
+        logger.info(f"Skipped {unchanged} events not updated since they were stored")
     logger.info(f"Backfill completed. Total events processed: {total_events_processed}")
     # Clear checkpoint after successful completion
-    clear_checkpoint()
+    clear_checkpoint(checkpoint_file)
+    return total_events_processed
+
+def rederive(EventBusArn, store):
+    """Rebuild the events of the store and send them without calling the Health API, returns the number of events sent"""
+    entries = []
+    for records in latest_records(store).values():
+        for scope, raw in records.items():
+            # Account IDs and the no account scope; the organization and account view records are skipped
+            if not scope.isdigit() and scope != NO_ACCOUNT_SCOPE:
+                continue
+            event_data = derive_account_event(raw, None if scope == NO_ACCOUNT_SCOPE else scope)
+            if event_data:
+                entries.append(event_entry(event_data, EventBusArn))
+    failed = put_events(EventBusArn, entries)
+    logger.info(f"Rederived {len(entries)} events from {store}, {failed} failed to send")
+    return len(entries) - failed
+
+def main():
+    DataCollectionAccountID, DataCollectionRegion, ResourcePrefix = get_user_input()
+    EventBusArn = event_bus_arn(DataCollectionAccountID, DataCollectionRegion, ResourcePrefix)
+    store = input("Enter raw response store (s3://<bucket>/<prefix> or local directory), Hit enter to not store responses: ").strip()
+    if store and input("Rebuild events from the store instead of calling the Health API (yes/no), Hit enter to use default (no): ").strip().lower() == 'yes':
+        rederive(EventBusArn, store)
+        return
+    selected = get_filter_input(organization=True)
+    backfill(EventBusArn, checkpoint_path(DataCollectionAccountID), selected, store or None)
 
 if __name__ == "__main__":
-    backfill()
+    main()
@@ -0,0 +1,28 @@
+"""Formatting helpers shared by the Health event backfill scripts."""
+
+# Format used by AWS Health EventBridge events for startTime, endTime and lastUpdatedTime
+HEALTH_TIME_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+
+def format_health_time(value):
+    return value.strftime(HEALTH_TIME_FORMAT)
+
+
+def add_canonical_fields(event_data, event_details):
+    """Add typed copies of the event times so queries do not have to parse the RFC-1123 strings.
+
+    Times are epoch seconds, eventDuration is in whole hours like DATE_DIFF('HOUR', ...).
+    """
+    start_time = event_details.get('startTime')
+    end_time = event_details.get('endTime')
+    last_updated_time = event_details.get('lastUpdatedTime')
+    if start_time:
+        event_data['startTimeEpoch'] = int(start_time.timestamp())
+    if end_time:
+        event_data['endTimeEpoch'] = int(end_time.timestamp())
+    if last_updated_time:
+        event_data['lastUpdatedTimeEpoch'] = int(last_updated_time.timestamp())
+    if start_time and end_time:
+        event_data['eventDuration'] = int((end_time - start_time).total_seconds() / 3600)
+    event_data['plannedLifeCycleEvent'] = 'Y' if 'PLANNED_LIFECYCLE_EVENT' in event_details.get('arn', '') else 'N'
+    return event_data
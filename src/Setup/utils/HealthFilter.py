@@ -0,0 +1,86 @@
+"""Health API event filters for the backfill scripts.
+
+The selection (services, categories, regions, time ranges, entity ARNs and,
+for the organization view, account IDs) is pushed down into the filter of
+describe_events and describe_events_for_organization, so a targeted backfill
+only pages through the matching events. Time ranges are given as a number of
+days back ("90") or as ISO dates ("2024-01-01..2024-03-31", either end optional).
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+EVENT_TYPE_CATEGORIES = ['issue', 'accountNotification', 'scheduledChange', 'investigation']
+
+
+def split_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()] if isinstance(text, str) else list(text or [])
+
+
+def parse_time(text):
+    time = datetime.fromisoformat(text.strip())
+    return time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+
+
+def parse_time_range(text, now=None):
+    """Return {'from': datetime, 'to': datetime} of '<days>' or '<from>..<to>', or None when text is empty"""
+    text = str(text or '').strip()
+    if not text or text == '0':
+        return None
+    if text.isdigit():
+        # From the start of the day, so a rerun on the same day resumes the checkpoint of the same filter
+        start = (now or datetime.now(timezone.utc)) - timedelta(days=int(text))
+        return {'from': start.replace(hour=0, minute=0, second=0, microsecond=0)}
+    start, _, end = text.partition('..')
+    time_range = {}
+    if start.strip():
+        time_range['from'] = parse_time(start)
+    if end.strip():
+        time_range['to'] = parse_time(end)
+    return time_range or None
+
+
+def selection(services='', categories='', regions='', start_time='', last_updated_time='', entity_arns='', account_ids=''):
+    """Return the backfill selection, lists and time ranges with empty entries dropped"""
+    selected = {
+        'services': [service.upper() for service in split_list(services)],
+        'eventTypeCategories': split_list(categories),
+        'regions': split_list(regions),
+        'startTime': parse_time_range(start_time),
+        'lastUpdatedTime': parse_time_range(last_updated_time),
+        'entityArns': split_list(entity_arns),
+        'awsAccountIds': split_list(account_ids),
+    }
+    unknown = [category for category in selected['eventTypeCategories'] if category not in EVENT_TYPE_CATEGORIES]
+    if unknown:
+        raise ValueError(f"Unknown event type categories {', '.join(unknown)}, expected {', '.join(EVENT_TYPE_CATEGORIES)}")
+    return {key: value for key, value in selected.items() if value}
+
+
+def account_filter(selected):
+    """EventFilter of describe_events; time ranges are lists and account IDs do not apply"""
+    event_filter = {key: value for key, value in selected.items() if key not in ('startTime', 'lastUpdatedTime', 'awsAccountIds')}
+    for key in ('startTime', 'lastUpdatedTime'):
+        if key in selected:
+            event_filter[f"{key}s"] = [selected[key]]
+    return event_filter
+
+
+def organization_filter(selected):
+    """OrganizationEventFilter of describe_events_for_organization"""
+    return dict(selected)
+
+
+def describe(selected):
+    """One line summary of a selection, also used to tell checkpoints of different selections apart"""
+    return json.dumps(selected, default=lambda time: time.isoformat(), sort_keys=True) if selected else 'all events'
+
+
+def get_filter_input(organization=False):
+    services = input("Enter comma-separated services to backfill (e.g. EC2,RDS), Hit enter for all: ")
+    categories = input(f"Enter comma-separated event type categories ({','.join(EVENT_TYPE_CATEGORIES)}), Hit enter for all: ")
+    regions = input("Enter comma-separated event regions, Hit enter for all: ")
+    start_time = input("Enter start time range as days back (e.g. 90) or from..to dates (e.g. 2024-01-01..2024-03-31), Hit enter for all: ")
+    last_updated_time = input("Enter last updated time range as days back or from..to dates, Hit enter for all: ")
+    entity_arns = input("Enter comma-separated affected entity ARNs, Hit enter for all: ")
+    account_ids = input("Enter comma-separated affected account IDs, Hit enter for all: ") if organization else ''
+    return selection(services, categories, regions, start_time, last_updated_time, entity_arns, account_ids)
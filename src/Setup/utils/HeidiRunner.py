@@ -0,0 +1,204 @@
+"""Run the backfill and tagging utilities without prompts, in one process.
+
+Settings come from a JSON config file, HEIDI_<SETTING> environment variables
+and --set SETTING=VALUE arguments, later sources overriding earlier ones. The
+selected jobs share the AWS clients and rate limiters of ClientPool, the
+Resource Explorer listing of the view and the Athena result cache, so TagBackFill
+followed by ListAffectedEntities lists the view once. Jobs run in JOBS order,
+or in parallel with MaxParallelJobs above 1, where a job of RUN_AFTER still
+waits for the job it reuses. Example config:
+
+    {
+      "Jobs": ["backfill", "tags", "entities"],
+      "DataCollectionAccountID": "111122223333",
+      "DataCollectionRegion": "us-east-1",
+      "ResourceExplorerViewArn": "arn:aws:resource-explorer-2:us-east-1:111122223333:view/all/..."
+    }
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ClientPool import event_bus_arn
+import HealthEventBackFill
+import HealthEventBackFillOrg
+from HealthFilter import selection
+import ListAffectedEntities
+import TagBackFill
+
+DEFAULTS = {
+    'Jobs': [],
+    'DataCollectionAccountID': '',
+    'DataCollectionRegion': '',
+    'ResourcePrefix': 'heidi-',
+    'ResourceExplorerViewArn': '',
+    'HeidiDataCollectionDB': 'datacollectiondb',
+    'AthenaResultBucket': '',
+    'Incremental': True,
+    'EntityRefreshDays': ListAffectedEntities.DEFAULT_REFRESH_DAYS,
+    'CheckpointDir': '.',
+    'MaxParallelJobs': 1,
+    # Backfill selection pushed down into the Health API filter, see HealthFilter
+    'Services': '',
+    'EventTypeCategories': '',
+    'Regions': '',
+    'StartTime': '',
+    'LastUpdatedTime': '',
+    'EntityArns': '',
+    'AccountIds': '',
+    # RawResponseStore location of the backfills; Rederive rebuilds events from it without calling the Health API
+    'RawStore': '',
+    'Rederive': False,
+}
+
+
+def bus_arn(settings):
+    return event_bus_arn(settings['DataCollectionAccountID'], settings['DataCollectionRegion'], settings['ResourcePrefix'])
+
+
+def backfill_selection(settings, organization=False):
+    return selection(settings['Services'], settings['EventTypeCategories'], settings['Regions'], settings['StartTime'],
+                     settings['LastUpdatedTime'], settings['EntityArns'], settings['AccountIds'] if organization else '')
+
+
+def run_backfill(settings):
+    if settings['Rederive']:
+        return HealthEventBackFill.rederive(bus_arn(settings), settings['RawStore'])
+    return HealthEventBackFill.backfill(bus_arn(settings), backfill_selection(settings), settings['RawStore'] or None)
+
+
+def run_backfill_org(settings):
+    if settings['Rederive']:
+        return HealthEventBackFillOrg.rederive(bus_arn(settings), settings['RawStore'])
+    checkpoint_file = HealthEventBackFillOrg.checkpoint_path(settings['DataCollectionAccountID'], settings['CheckpointDir'])
+    return HealthEventBackFillOrg.backfill(bus_arn(settings), checkpoint_file, backfill_selection(settings, organization=True), settings['RawStore'] or None)
+
+
+def run_tags(settings):
+    return TagBackFill.resource_explorer(settings['ResourceExplorerViewArn'], bus_arn(settings))
+
+
+def run_entities(settings):
+    athena_bucket = settings['AthenaResultBucket'] or f"aws-athena-query-results-{settings['DataCollectionRegion']}-{settings['DataCollectionAccountID']}"
+    return ListAffectedEntities.list_entities(
+        settings['DataCollectionAccountID'], settings['DataCollectionRegion'], settings['ResourcePrefix'],
+        settings['HeidiDataCollectionDB'], athena_bucket, settings['ResourceExplorerViewArn'],
+        settings['Incremental'], settings['CheckpointDir'], settings['EntityRefreshDays'])
+
+
+# Job name: (function, settings it needs), run in this order
+JOBS = {
+    'backfill': (run_backfill, ['DataCollectionAccountID', 'DataCollectionRegion']),
+    'backfill-org': (run_backfill_org, ['DataCollectionAccountID', 'DataCollectionRegion']),
+    'tags': (run_tags, ['DataCollectionAccountID', 'DataCollectionRegion', 'ResourceExplorerViewArn']),
+    'entities': (run_entities, ['DataCollectionAccountID', 'DataCollectionRegion', 'ResourceExplorerViewArn']),
+}
+# Job: job it waits for when both are selected; entities reuses the Resource Explorer listing of tags
+RUN_AFTER = {'entities': 'tags'}
+
+
+def parse_value(name, value):
+    """Convert a string setting to the type of its default"""
+    default = DEFAULTS.get(name)
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ('yes', 'true', '1')
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, list):
+        return [item.strip() for item in str(value).split(',') if item.strip()]
+    return value
+
+
+def load_settings(config_file=None, overrides=(), environ=os.environ):
+    """Merge defaults, the config file, HEIDI_<SETTING> variables and SETTING=VALUE overrides"""
+    settings = dict(DEFAULTS)
+    if config_file:
+        with open(config_file, 'r') as f:
+            settings.update(json.load(f))
+    for name in DEFAULTS:
+        if f"HEIDI_{name.upper()}" in environ:
+            settings[name] = parse_value(name, environ[f"HEIDI_{name.upper()}"])
+    for override in overrides:
+        name, _, value = override.partition('=')
+        if name not in DEFAULTS:
+            raise ValueError(f"Unknown setting {name}, expected one of {', '.join(DEFAULTS)}")
+        settings[name] = parse_value(name, value)
+    return settings
+
+
+def validate(settings):
+    """Return the problems that keep the selected jobs from running"""
+    problems = [f"Unknown job {job}, expected one of {', '.join(JOBS)}" for job in settings['Jobs'] if job not in JOBS]
+    if not settings['Jobs']:
+        problems.append("No jobs selected")
+    for job in settings['Jobs']:
+        problems.extend(f"{job} needs {name}" for name in JOBS.get(job, (None, []))[1] if not settings[name])
+    if settings['Rederive'] and not settings['RawStore']:
+        problems.append("Rederive needs RawStore")
+    return problems
+
+
+def run_job(job, settings):
+    """Run one job, return (job, result, seconds, error)"""
+    print(f"\n=== {job} ===")
+    start = time.perf_counter()
+    try:
+        return job, JOBS[job][0](settings), time.perf_counter() - start, None
+    except Exception as e:
+        print(f"Error running {job}: {e}")
+        return job, None, time.perf_counter() - start, e
+
+
+def run_job_after(future, job, settings):
+    if future is not None:
+        future.result()
+    return run_job(job, settings)
+
+
+def run_jobs(settings):
+    """Run the selected jobs and return [(job, result, seconds, error)]"""
+    jobs = [job for job in JOBS if job in settings['Jobs']]
+    if settings['MaxParallelJobs'] > 1:
+        with ThreadPoolExecutor(max_workers=settings['MaxParallelJobs']) as executor:
+            futures = {}
+            # Jobs start in submission order, so the job waited for is already running
+            for job in jobs:
+                futures[job] = executor.submit(run_job_after, futures.get(RUN_AFTER.get(job)), job, settings)
+            return [futures[job].result() for job in jobs]
+    return [run_job(job, settings) for job in jobs]
+
+
+def print_summary(results):
+    print(f"\n{'JOB':<14} {'STATUS':<8} {'EVENTS':>8} {'SECONDS':>9}")
+    for job, result, seconds, error in results:
+        print(f"{job:<14} {'FAILED' if error else 'OK':<8} {result if result is not None else '-':>8} {seconds:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Heidi backfill and tagging jobs without prompts")
+    parser.add_argument('--config', help="JSON file with the settings")
+    parser.add_argument('--jobs', help=f"Comma-separated jobs to run: {', '.join(JOBS)}")
+    parser.add_argument('--set', action='append', default=[], metavar='SETTING=VALUE', help="Override a setting, can be repeated")
+    args = parser.parse_args()
+
+    overrides = args.set + ([f"Jobs={args.jobs}"] if args.jobs else [])
+    try:
+        settings = load_settings(args.config, overrides)
+    except (OSError, ValueError) as e:
+        print(f"Error reading settings: {e}")
+        exit(1)
+    problems = validate(settings)
+    if problems:
+        print('\n'.join(problems))
+        exit(1)
+
+    results = run_jobs(settings)
+    print_summary(results)
+    if any(error for _, _, _, error in results):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Measure cold start, warm latency and memory of the Heidi Lambda functions locally.
+
+Packaged functions are imported from src/HealthModule/functions and inline ones
+are read from the ZipFile of their template, as LambdaHarness does. The cold
+start is the time to load the module in a fresh interpreter, imports included,
+together with the peak RSS of that interpreter.
+Warm invocations run in this process with every AWS call answered by a canned
+response, so the latency is the time the handler itself spends per invocation
+and per event. An optional simulated latency per AWS call approximates the
+network. Python allocations of one invocation are traced separately, so
+tracing does not slow down the timed runs. The numbers come from the local CPU.
+Compare them between versions of a function, and compare the RSS against the
+MemorySize of the function.
+"""
+import copy
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import redirect_stdout
+
+import boto3
+from botocore.awsrequest import AWSResponse
+
+from LambdaHarness import function_code, load_module
+
+HEALTH_MODULE = "../../HealthModule"
+FUNCTIONS_DIR = f"{HEALTH_MODULE}/functions"
+BUS_ARN = "arn:aws:events:us-east-1:111122223333:event-bus/heidi-DataCollectionBus-111122223333"
+VIEW_ARN = "arn:aws:resource-explorer-2:us-east-1:111122223333:view/heidi/00000000-0000-0000-0000-000000000000"
+EVENT_ARN = "arn:aws:health:us-east-1::event/EC2/AWS_EC2_MAINTENANCE_SCHEDULED/AWS_EC2_MAINTENANCE_SCHEDULED_{index}"
+# Loads the function in a fresh interpreter and reports its init time and peak RSS
+COLD_START_SCRIPT = """
+import importlib, json, resource, sys, time
+source = json.load(sys.stdin)
+start = time.perf_counter()
+if 'module' in source:
+    sys.path.insert(0, source['path'])
+    importlib.import_module(source['module'])
+else:
+    exec(compile(source['code'], 'index', 'exec'), {'__name__': 'index'})
+init_seconds = time.perf_counter() - start
+# ru_maxrss keeps the peak of the parent this interpreter was forked from, VmHWM starts over at exec
+try:
+    with open('/proc/self/status') as status:
+        max_rss_kb = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+except OSError:
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'init_seconds': init_seconds, 'max_rss_mb': max_rss_kb / 1024}))
+"""
+
+
+def entity_arns(count):
+    return [f"arn:aws:ec2:us-east-1:111122223333:instance/i-{index:017x}" for index in range(count)]
+
+
+def health_event(entities):
+    """EventBridge event of the DataCollection bus with entities affected entities"""
+    return {
+        'version': '0',
+        'id': '5a527972-98c1-9ddd-2107-49e6b72268d9',
+        'detail-type': 'AWS Health Event',
+        'source': 'aws.health',
+        'account': '111122223333',
+        'time': '2024-01-02T03:30:00Z',
+        'region': 'us-east-1',
+        'resources': [],
+        'detail': {
+            'eventArn': EVENT_ARN.format(index=0),
+            'service': 'EC2',
+            'eventTypeCode': 'AWS_EC2_MAINTENANCE_SCHEDULED',
+            'eventTypeCategory': 'scheduledChange',
+            'statusCode': 'upcoming',
+            'eventRegion': 'us-east-1',
+            'startTime': 'Tue, 02 Jan 2024 03:30:00 GMT',
+            'lastUpdatedTime': 'Tue, 02 Jan 2024 03:13:27 GMT',
+            'eventDescription': [{'language': 'en_US', 'latestDescription': 'Scheduled maintenance'}],
+            'affectedEntities': [{'entityValue': arn, 'status': 'IMPAIRED'} for arn in entity_arns(entities)],
+        },
+    }
+
+
+def batch_get_items(request, item):
+    """BatchGetItem response returning every requested key with the attributes of item"""
+    return {
+        'Responses': {
+            table: [{**keys, **item} for keys in request_keys['Keys']]
+            for table, request_keys in request['RequestItems'].items()
+        },
+        'UnprocessedKeys': {},
+    }
+
+
+def health_summary(index):
+    return {
+        'arn': EVENT_ARN.format(index=index), 'service': 'EC2', 'eventTypeCode': 'AWS_EC2_MAINTENANCE_SCHEDULED',
+        'eventTypeCategory': 'scheduledChange', 'region': 'us-east-1', 'statusCode': 'upcoming',
+        'startTime': 1704166200, 'lastUpdatedTime': 1704165207,
+    }
+
+
+def benchmarks(entities, backfill_events):
+    """Return {name: benchmark} of the inline functions, entities per event and events per backfill"""
+    put_events = {'FailedEntryCount': 0, 'Entries': [{'EventId': 'benchmark'}]}
+    stored_item = {
+        'lastUpdatedTimeEpoch': {'N': '1704165000'}, 'payloadHash': {'S': 'benchmark'}, 'entityChunks': {'N': '0'},
+        'affectedEntities': {'S': ', '.join(entity_arns(entities))},
+    }
+    return {
+        'taginfo': {
+            'module': 'taginfo',
+            'environment': {'ResourceExplorerViewArn': VIEW_ARN, 'EventBusName': BUS_ARN},
+            'event': health_event(entities),
+            'events': 1,
+            'responses': {
+                'Search': lambda request: {
+                    'Resources': [{'Arn': request['QueryString'][len('id:'):], 'Properties': [{'Name': 'tags', 'Data': [{'Key': 'App', 'Value': 'Heidi'}]}]}],
+                    'Count': {'TotalResources': 1, 'Complete': True}, 'ViewArn': VIEW_ARN,
+                },
+                'PutEvents': put_events,
+            },
+        },
+        'eventurl-ingest': {
+            'module': 'event_url_ingest',
+            'environment': {'DynamoDBName': 'heidi-benchmark', 'ApiCacheEnabled': 'no'},
+            'event': health_event(entities),
+            'events': 1,
+            'responses': {
+                'BatchGetItem': {'Responses': {'heidi-benchmark': []}, 'UnprocessedKeys': {}},
+                'PutItem': {},
+                'BatchWriteItem': {'UnprocessedItems': {}},
+            },
+        },
+        'eventurl-lookup': {
+            'module': 'event_url_lookup',
+            'environment': {'DynamoDBName': 'heidi-benchmark'},
+            'event': {'httpMethod': 'GET', 'queryStringParameters': {
+                'keys': ','.join(f"{EVENT_ARN.format(index=index)}|111122223333" for index in range(backfill_events)),
+                'includeEntities': 'true',
+            }},
+            'events': backfill_events,
+            'responses': {'BatchGetItem': lambda request: batch_get_items(request, stored_item)},
+        },
+        'backfill': {
+            'template': f"{HEALTH_MODULE}/OrgHealthEventBackFill.Yaml",
+            'resource': 'LambdaBackfillEvents',
+            'environment': {'EventBusArnVal': BUS_ARN},
+            'event': {'startDays': 90},
+            'events': backfill_events,
+            'responses': {
+                'DescribeEvents': {'events': [health_summary(index) for index in range(backfill_events)]},
+                'DescribeEventDetails': lambda request: {'successfulSet': [{
+                    'event': health_summary(int(request['eventArns'][0].rsplit('_', 1)[1])),
+                    'eventDescription': {'latestDescription': 'Scheduled maintenance'},
+                }], 'failedSet': []},
+                'DescribeAffectedEntities': {'entities': [{'entityValue': arn, 'statusCode': 'IMPAIRED'} for arn in entity_arns(entities)]},
+                'PutEvents': put_events,
+            },
+        },
+    }
+
+
+class CannedBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def use_canned_responses(responses, latency_ms=0):
+    """Answer every AWS call of clients created from now on with responses[operation]; returns the call counter"""
+    calls = Counter()
+
+    def respond(request, event_name, **kwargs):
+        operation = event_name.rsplit('.', 1)[1]
+        if operation not in responses:
+            raise KeyError(f"No canned response for {operation}")
+        calls[operation] += 1
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        body = responses[operation]
+        if callable(body):
+            body = body(json.loads(request.body or b'{}'))
+        return AWSResponse(request.url, 200, {'x-amzn-RequestId': 'benchmark'}, CannedBody(json.dumps(body).encode('utf-8')))
+
+    # Requests are signed before they are answered, the credentials are never sent anywhere
+    boto3.setup_default_session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark', region_name='us-east-1')
+    boto3.DEFAULT_SESSION.events.register('before-send', respond)
+    return calls
+
+
+def function_source(benchmark):
+    """Return what COLD_START_SCRIPT loads: a packaged module or the inline code of a template"""
+    if 'module' in benchmark:
+        return {'module': benchmark['module'], 'path': os.path.abspath(FUNCTIONS_DIR)}
+    return {'code': function_code(benchmark['template'], benchmark['resource'])}
+
+
+def load_handler(source):
+    # Loaded afresh, so no client created for the canned responses of another benchmark is reused
+    if 'module' in source:
+        return load_module(source['path'], source['module']).lambda_handler
+    namespace = {'__name__': 'index'}
+    exec(compile(source['code'], 'index', 'exec'), namespace)
+    return namespace['lambda_handler']
+
+
+def cold_start(source, environment, runs):
+    """Return (median init seconds, max RSS MB) of runs fresh interpreters"""
+    env = {**os.environ, 'AWS_DEFAULT_REGION': 'us-east-1', **environment}
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT], input=json.dumps(source), env=env, capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return statistics.median(result['init_seconds'] for result in results), max(result['max_rss_mb'] for result in results)
+
+
+def invoke_handler(source, benchmark, invocations, calls):
+    handler = load_handler(source)
+    # The first invocation creates the clients
+    start = time.perf_counter()
+    handler(copy.deepcopy(benchmark['event']), None)
+    first = time.perf_counter() - start
+    calls.clear()
+
+    timings = []
+    for _ in range(invocations):
+        event = copy.deepcopy(benchmark['event'])
+        start = time.perf_counter()
+        handler(event, None)
+        timings.append(time.perf_counter() - start)
+    calls_per_invocation = sum(calls.values()) / invocations
+
+    tracemalloc.start()
+    handler(copy.deepcopy(benchmark['event']), None)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first, timings, peak, calls_per_invocation
+
+
+def warm_invocations(source, benchmark, invocations, latency_ms):
+    """Return the first and warm invocation seconds, the traced peak bytes and AWS calls of one invocation"""
+    calls = use_canned_responses(benchmark['responses'], latency_ms)
+    previous = {name: os.environ.get(name) for name in benchmark['environment']}
+    os.environ.update(benchmark['environment'])
+    try:
+        # The handlers print progress, which would flood the output of the benchmark
+        with redirect_stdout(io.StringIO()):
+            return invoke_handler(source, benchmark, invocations, calls)
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def run_benchmark(benchmark, invocations, cold_runs, latency_ms):
+    source = function_source(benchmark)
+    init_seconds, max_rss_mb = cold_start(source, benchmark['environment'], cold_runs)
+    first, timings, peak, calls = warm_invocations(source, benchmark, invocations, latency_ms)
+    p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+    return {
+        'init_ms': init_seconds * 1000,
+        'max_rss_mb': max_rss_mb,
+        'first_ms': first * 1000,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': p95 * 1000,
+        'per_event_ms': statistics.median(timings) * 1000 / benchmark['events'],
+        'peak_kb': peak / 1024,
+        'calls': calls,
+    }
+
+
+def print_results(results):
+    print(f"\n{'FUNCTION':<16} {'INIT ms':>8} {'RSS MB':>7} {'FIRST ms':>9} {'P50 ms':>8} {'P95 ms':>8} {'EVENT ms':>9} {'PEAK KB':>8} {'CALLS':>6}")
+    for name, result in results.items():
+        print(f"{name:<16} {result['init_ms']:>8.1f} {result['max_rss_mb']:>7.1f} {result['first_ms']:>9.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['per_event_ms']:>9.3f} {result['peak_kb']:>8.0f} {result['calls']:>6.0f}")
+
+
+def get_user_input():
+    names = input(f"Enter comma-separated functions to benchmark, Hit enter to use default ({','.join(benchmarks(1, 1))}): ").strip()
+    invocations = input("Enter warm invocations per function, Hit enter to use default (50): ").strip() or '50'
+    cold_runs = input("Enter cold starts per function, Hit enter to use default (5): ").strip() or '5'
+    entities = input("Enter affected entities per event, Hit enter to use default (10): ").strip() or '10'
+    backfill_events = input("Enter events per backfill and lookup invocation, Hit enter to use default (20): ").strip() or '20'
+    latency_ms = input("Enter simulated latency per AWS call in ms, Hit enter to use default (0): ").strip() or '0'
+    name_list = [name.strip() for name in names.split(',') if name.strip()]
+    return name_list, int(invocations), int(cold_runs), int(entities), int(backfill_events), float(latency_ms)
+
+
+def main():
+    names, invocations, cold_runs, entities, backfill_events, latency_ms = get_user_input()
+    available = benchmarks(entities, backfill_events)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        print(f"Unknown functions {', '.join(unknown)}, expected {', '.join(available)}")
+        exit(1)
+    results = {}
+    for name in names or available:
+        print(f"Benchmarking {name}...")
+        results[name] = run_benchmark(available[name], invocations, cold_runs, latency_ms)
+    print_results(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Run an inline CloudFormation Lambda locally against sample records.
+
+The function code is read from the ZipFile of the template, so what runs here is
+exactly what the stack deploys. Packaged functions are imported from
+src/HealthModule/functions with load_module. Records are wrapped the way Firehose hands them
+to a transformation Lambda, and the transformed records are printed as JSON.
+"""
+import base64
+import csv
+import importlib
+import json
+import os
+import sys
+
+import yaml
+
+from DataLakeIO import iter_json_records
+
+
+class TemplateLoader(yaml.SafeLoader):
+    """SafeLoader that accepts the CloudFormation short-form tags (!Ref, !Sub, ...)"""
+
+
+def _construct_tagged(loader, suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_mapping(node, deep=True)
+
+
+TemplateLoader.add_multi_constructor('!', _construct_tagged)
+
+
+def function_code(template_path, resource_name):
+    """Return the ZipFile source of an inline Lambda function"""
+    with open(template_path) as file:
+        template = yaml.load(file, Loader=TemplateLoader)
+    return template['Resources'][resource_name]['Properties']['Code']['ZipFile']
+
+
+def load_function(template_path, resource_name):
+    """Return the module namespace of an inline Lambda function"""
+    code = function_code(template_path, resource_name)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    namespace = {'__name__': resource_name}
+    exec(compile(code, resource_name, 'exec'), namespace)
+    return namespace
+
+
+def load_module(functions_dir, module_name):
+    """Import a packaged Lambda function module afresh, together with the helpers it imports from functions_dir"""
+    functions_dir = os.path.abspath(functions_dir)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if functions_dir not in sys.path:
+        sys.path.insert(0, functions_dir)
+    for name in [name for name, module in sys.modules.items() if os.path.dirname(getattr(module, '__file__', None) or '') == functions_dir]:
+        del sys.modules[name]
+    return importlib.import_module(module_name)
+
+
+def load_accounts_csv(path):
+    """Build an account directory from an accountsinfo CSV instead of calling Organizations"""
+    with open(path, encoding='utf-8-sig') as file:
+        rows = list(csv.DictReader(file))
+    return {
+        row['Account ID'].strip('"'): {
+            'name': row['Name'],
+            'oupath': '',
+            'tags': [{'key': 'Tag', 'value': row['Tag']}] if row.get('Tag') else []
+        }
+        for row in rows
+    }
+
+
+def firehose_event(records):
+    return {
+        'records': [
+            {'recordId': str(index), 'data': base64.b64encode(json.dumps(record).encode('utf-8')).decode('utf-8')}
+            for index, record in enumerate(records)
+        ]
+    }
+
+
+def run(function, records):
+    """Invoke the function with the records wrapped as a Firehose event; returns the decoded output records"""
+    response = function['lambda_handler'](firehose_event(records), None)
+    return [
+        {'recordId': record['recordId'], 'result': record['result'], 'data': json.loads(base64.b64decode(record['data']))}
+        for record in response['records']
+    ]
+
+
+def get_user_input():
+    template_path = input("Enter template path, Hit enter to use default (../../DataCollectionModule/DataCollectionModule.yaml): ").strip() or '../../DataCollectionModule/DataCollectionModule.yaml'
+    resource_name = input("Enter Lambda resource name, Hit enter to use default (AccountEnrichmentLambda): ").strip() or 'AccountEnrichmentLambda'
+    records_path = input("Enter path of a file with sample records (JSON, one or more documents): ").strip()
+    accounts_path = input("Enter accountsinfo CSV to use instead of AWS Organizations, Hit enter to call Organizations: ").strip()
+    return template_path, resource_name, records_path, accounts_path
+
+
+def main():
+    template_path, resource_name, records_path, accounts_path = get_user_input()
+    function = load_function(template_path, resource_name)
+    if accounts_path:
+        directory = load_accounts_csv(accounts_path)
+        function['load_account_directory'] = lambda: directory
+    with open(records_path, 'rb') as file:
+        body = file.read()
+    documents = list(iter_json_records(body))
+    # Accept a single JSON array as well as newline delimited records
+    records = documents[0] if len(documents) == 1 and isinstance(documents[0], list) else documents
+    for record in run(function, records):
+        print(json.dumps(record, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,37 @@
-import boto3
-import time
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 
-# Get user inputs
-DataCollectionAccountID = input("Enter DataCollection Account ID: ")
-DataCollectionRegion = input("Enter DataCollection region: ")
-ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
-HeidiDataCollectionDB = input("Enter HeidiDataCollectionDB name, Hit enter to use default (datacollectiondb): ") or "datacollectiondb"
-default_athena_bucket = f"aws-athena-query-results-{DataCollectionRegion}-{DataCollectionAccountID}"
-AthenaResultBucket = input(f"Enter AthenaResultBucket, Hit enter to use default ({default_athena_bucket}): ") or default_athena_bucket
-ResourceExplorerViewArn = input("Enter Resource Explorer view ARN: ")
+from AthenaQuery import run_query
+from ClientPool import cached_resource_tags, event_bus_arn, get_client, get_event_bus_client, resource_tag_list
 
-# Checkpoint file path
-CHECKPOINT_FILE = f"checkpoint_listentities_{DataCollectionAccountID}.json"
+# Entities found in Resource Explorer are looked up again when they reappear after this many days
+DEFAULT_REFRESH_DAYS = 7
 
 
-def save_checkpoint(processed_arns, next_token=None):
+def get_user_input():
+    DataCollectionAccountID = input("Enter DataCollection Account ID: ")
+    DataCollectionRegion = input("Enter DataCollection region: ")
+    ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+    HeidiDataCollectionDB = input("Enter HeidiDataCollectionDB name, Hit enter to use default (datacollectiondb): ") or "datacollectiondb"
+    default_athena_bucket = f"aws-athena-query-results-{DataCollectionRegion}-{DataCollectionAccountID}"
+    AthenaResultBucket = input(f"Enter AthenaResultBucket, Hit enter to use default ({default_athena_bucket}): ") or default_athena_bucket
+    ResourceExplorerViewArn = input("Enter Resource Explorer view ARN: ")
+    Incremental = (input("Only process partitions and entities not seen by the previous run (yes/no), Hit enter to use default (yes): ") or "yes").lower() == "yes"
+    return DataCollectionAccountID, DataCollectionRegion, ResourcePrefix, HeidiDataCollectionDB, AthenaResultBucket, ResourceExplorerViewArn, Incremental
+
+
+def checkpoint_path(account_id, checkpoint_dir='.'):
+    """Checkpoint file path"""
+    return os.path.join(checkpoint_dir, f"checkpoint_listentities_{account_id}.json")
+
+
+def watermark_path(account_id, checkpoint_dir='.'):
+    """Watermark of the last completed run, kept across runs for the incremental mode"""
+    return os.path.join(checkpoint_dir, f"watermark_listentities_{account_id}.json")
+
+
+def save_checkpoint(checkpoint_file, processed_arns, next_token=None):
     """Save checkpoint to file"""
     checkpoint = {
         'processed_arns': list(processed_arns),
@@ -25,17 +39,17 @@ def save_checkpoint(processed_arns, next_token=None):
         'timestamp': datetime.now().isoformat()
     }
     try:
-        with open(CHECKPOINT_FILE, 'w') as f:
+        with open(checkpoint_file, 'w') as f:
             json.dump(checkpoint, f)
         print(f"Checkpoint saved: {len(processed_arns)} ARNs processed")
     except Exception as e:
         print(f"Error saving checkpoint: {e}")
 
-def load_checkpoint():
+def load_checkpoint(checkpoint_file):
     """Load checkpoint from file"""
-    if os.path.exists(CHECKPOINT_FILE):
+    if os.path.exists(checkpoint_file):
         try:
-            with open(CHECKPOINT_FILE, 'r') as f:
+            with open(checkpoint_file, 'r') as f:
                 checkpoint = json.load(f)
             print(f"Checkpoint loaded: {len(checkpoint['processed_arns'])} ARNs already processed")
             return checkpoint
@@ -44,52 +58,62 @@ def load_checkpoint():
             return None
     return None
 
-def clear_checkpoint():
+def clear_checkpoint(checkpoint_file):
     """Remove checkpoint file after successful completion"""
-    if os.path.exists(CHECKPOINT_FILE):
+    if os.path.exists(checkpoint_file):
         try:
-            os.remove(CHECKPOINT_FILE)
+            os.remove(checkpoint_file)
             print("Checkpoint file removed after successful completion")
         except Exception as e:
             print(f"Error removing checkpoint file: {e}")
 
-def query_athena(query, database, output_location, region):
-    athena_client = boto3.client('athena', region_name=region)
-    response = athena_client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={'Database': database},
-        ResultConfiguration={'OutputLocation': output_location}
-    )
-    
-    query_execution_id = response['QueryExecutionId']
-    print(f"Query execution started with ID: {query_execution_id}")
-    
-    while True:
-        query_status = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-        status = query_status['QueryExecution']['Status']['State']
-        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            break
-        print(f"Query status: {status}. Waiting...")
-        time.sleep(2)
-    
-    if status == 'SUCCEEDED':
+def load_watermark(watermark_file):
+    """Load the last processed date_created partition and when each ARN was last found"""
+    if os.path.exists(watermark_file):
+        try:
+            with open(watermark_file, 'r') as f:
+                watermark = json.load(f)
+            # Watermarks of earlier versions list the ARNs without the time they were found
+            if not isinstance(watermark['seen_arns'], dict):
+                watermark['seen_arns'] = {}
+            print(f"Watermark loaded: partitions from {watermark['last_partition']}, {len(watermark['seen_arns'])} ARNs already looked up")
+            return watermark
+        except Exception as e:
+            print(f"Error loading watermark: {e}")
+    return None
+
+def save_watermark(watermark_file, last_partition, seen_arns):
+    try:
+        with open(watermark_file, 'w') as f:
+            json.dump({'last_partition': last_partition, 'seen_arns': dict(sorted(seen_arns.items())), 'timestamp': datetime.now().isoformat()}, f)
+        print(f"Watermark saved: next run starts at partition {last_partition}")
+    except Exception as e:
+        print(f"Error saving watermark: {e}")
+
+def query_athena(query, database, output_location, region, partitions=()):
+    try:
+        results = run_query(query, database, region, output_location=output_location, partitions=partitions)
         print("Query succeeded!")
-        return athena_client.get_query_results(QueryExecutionId=query_execution_id)
-    else:
-        error_message = query_status['QueryExecution']['Status'].get('StateChangeReason', 'Unknown error')
-        print(f"Query failed: {error_message}")
+        return results
+    except Exception as e:
+        print(f"Query failed: {e}")
         return None
 
 
-def query_resource_explorer_batch(arns, view_arn, processed_arns_set):
-    region = view_arn.split(":")[3]
-    resource_explorer = boto3.client('resource-explorer-2', region)
-    
+def query_resource_explorer_batch(arns, view_arn, processed_arns_set, checkpoint_file):
     arn_to_tags = {}
     arns_set = set(arns) - processed_arns_set  # Skip already processed ARNs
     
+    # A view listed by TagBackFill earlier in this process is looked up in memory
+    listing = cached_resource_tags(view_arn)
+    if listing is not None:
+        arn_to_tags = {arn: listing[arn] for arn in arns_set if arn in listing}
+        print(f"Found {len(arn_to_tags)}/{len(arns)} in the Resource Explorer listing of this run\n")
+        return arn_to_tags
+    
     print(f"\nQuerying Resource Explorer for {len(arns_set)} ARNs (skipping {len(processed_arns_set)} already processed)...")
     
+    resource_explorer = get_client('resource-explorer-2', view_arn.split(":")[3])
     paginator = resource_explorer.get_paginator('list_resources')
     response_iterator = paginator.paginate(ViewArn=view_arn, PaginationConfig={'PageSize': 1000})
     
@@ -104,9 +128,7 @@ def query_resource_explorer_batch(arns, view_arn, processed_arns_set):
             resource_arn = resource.get('Arn')
             
             if resource_arn in arns_set:
-                tags = [{'entityKey': item['Key'], 'entityValue': item['Value']} 
-                        for prop in resource.get('Properties', []) 
-                        for item in prop.get('Data', [])]
+                tags = resource_tag_list(resource)
                 arn_to_tags[resource_arn] = tags
                 print(f"Found: {resource_arn} ({len(tags)} tags)")
                 arns_set.remove(resource_arn)
@@ -117,7 +139,7 @@ def query_resource_explorer_batch(arns, view_arn, processed_arns_set):
                     break
         
         # Save checkpoint after each page
-        save_checkpoint(processed_arns_set)
+        save_checkpoint(checkpoint_file, processed_arns_set)
         
         # Stop going to next page if we found all ARNs
         if not arns_set:
@@ -127,36 +149,35 @@ def query_resource_explorer_batch(arns, view_arn, processed_arns_set):
     return arn_to_tags
 
 
-def send_tags_to_eventbridge(arn, tags):
-    eventbridge_client = boto3.client('events', DataCollectionRegion)
-    event_bus_arn = f"arn:aws:events:{DataCollectionRegion}:{DataCollectionAccountID}:event-bus/{ResourcePrefix}DataCollectionBus-{DataCollectionAccountID}"
-    
+def send_tags_to_eventbridge(arn, tags, bus_arn):
     tag_data = {'entityArn': arn, 'tags': tags}
-    return eventbridge_client.put_events(
+    return get_event_bus_client(bus_arn).put_events(
         Entries=[{
             'Source': 'heidi.taginfo',
             'DetailType': 'Heidi tags from resource explorer',
             'Detail': json.dumps(tag_data),
-            'EventBusName': event_bus_arn
+            'EventBusName': bus_arn
         }]
     )
 
 
-def list_affected_entities(database_name, output_location, region):
+def list_affected_entities(database_name, output_location, region, since=None):
+    # The date_created projection prunes the scan to partitions at or after since
+    partition_filter = f"AND date_created >= '{since}'" if since else ""
     query = f"""
     SELECT DISTINCT entities.entityValue AS affectedEntities
     FROM "AwsDataCatalog"."{database_name}"."awshealthevent"
     CROSS JOIN UNNEST(detail.affectedEntities) AS t(entities)
-    WHERE entities.entityValue IS NOT NULL
+    WHERE entities.entityValue IS NOT NULL {partition_filter}
     ORDER BY affectedEntities
     """
     
     print(f"Querying Athena database: {database_name}\n")
-    results = query_athena(query, database_name, output_location, region)
+    results = query_athena(query, database_name, output_location, region, [f"date_created>={since}" if since else "all"])
     
     if not results:
         print("Failed to retrieve results from Athena.")
-        return []
+        return None
     
     rows = results['ResultSet']['Rows']
     if len(rows) <= 1:
@@ -168,43 +189,77 @@ def list_affected_entities(database_name, output_location, region):
     return affected_arns
 
 
-def main():
+def list_entities(DataCollectionAccountID, DataCollectionRegion, ResourcePrefix, HeidiDataCollectionDB, AthenaResultBucket, ResourceExplorerViewArn, Incremental=True, checkpoint_dir='.', refresh_days=DEFAULT_REFRESH_DAYS):
+    """Send the tags of the entities affected by Health events, returns the number of events sent"""
     database_name = f"{ResourcePrefix}{HeidiDataCollectionDB}"
+    bus_arn = event_bus_arn(DataCollectionAccountID, DataCollectionRegion, ResourcePrefix)
+    checkpoint_file = checkpoint_path(DataCollectionAccountID, checkpoint_dir)
+    watermark_file = watermark_path(DataCollectionAccountID, checkpoint_dir)
     output_location = f"s3://{AthenaResultBucket}/"
     
     print(f"\nConfiguration:")
     print(f"  Account ID: {DataCollectionAccountID}")
     print(f"  Region: {DataCollectionRegion}")
     print(f"  Database: {database_name}")
-    print(f"  Resource Explorer View ARN: {ResourceExplorerViewArn}\n")
+    print(f"  Resource Explorer View ARN: {ResourceExplorerViewArn}")
+    print(f"  Incremental: {'yes' if Incremental else 'no'}\n")
     
     # Load checkpoint if exists
-    checkpoint = load_checkpoint()
+    checkpoint = load_checkpoint(checkpoint_file)
     processed_arns_set = set(checkpoint['processed_arns']) if checkpoint else set()
     
+    # The partition being written today is read again by the next run
+    run_partition = datetime.now(timezone.utc).strftime('%Y/%m/%d')
+    watermark = load_watermark(watermark_file) if Incremental else None
+    # ARNs found within the refresh interval are skipped, older ones are dropped so the watermark stays bounded
+    now = int(datetime.now(timezone.utc).timestamp())
+    refresh_after = now - refresh_days * 86400
+    seen_arns = {arn: found_at for arn, found_at in watermark['seen_arns'].items() if found_at > refresh_after} if watermark else {}
+    
     # Get affected entities from Athena
-    affected_arns = list_affected_entities(database_name, output_location, DataCollectionRegion)
+    affected_arns = list_affected_entities(database_name, output_location, DataCollectionRegion, watermark['last_partition'] if watermark else None)
+    if affected_arns is None:
+        raise RuntimeError("Failed to list the affected entities")
+    new_arns = [arn for arn in affected_arns if arn not in seen_arns]
+    if Incremental and watermark:
+        print(f"{len(new_arns)} of {len(affected_arns)} affected entities not looked up before\n")
+    affected_arns = new_arns
     if not affected_arns:
-        return
+        save_watermark(watermark_file, run_partition, seen_arns)
+        clear_checkpoint(checkpoint_file)
+        return 0
     
     # Query Resource Explorer for tags
-    arn_to_tags = query_resource_explorer_batch(affected_arns, ResourceExplorerViewArn, processed_arns_set)
+    arn_to_tags = query_resource_explorer_batch(affected_arns, ResourceExplorerViewArn, processed_arns_set, checkpoint_file)
     
     # Send tags to EventBridge
+    events_sent = 0
     if arn_to_tags:
         print("Sending tags to EventBridge...")
-        events_sent = 0
         for arn, tags in arn_to_tags.items():
-            if tags:
-                send_tags_to_eventbridge(arn, tags)
-                events_sent += 1
-                print(f"Sent: {arn} ({len(tags)} tags)")
+            # Untagged entities are sent too so the tag snapshot drops removed tags
+            send_tags_to_eventbridge(arn, tags, bus_arn)
+            events_sent += 1
+            print(f"Sent: {arn} ({len(tags)} tags)")
         print(f"\nTotal events sent: {events_sent}/{len(arn_to_tags)}")
     else:
         print("No tags found for affected entities.")
     
+    # Only found entities are remembered, the others are looked up again when they reappear in a newer
+    # partition; entities of older partitions that were never found are only retried by a full run
+    seen_arns.update((arn, now) for arn in arn_to_tags)
+    save_watermark(watermark_file, run_partition, seen_arns)
     # Clear checkpoint after successful completion
-    clear_checkpoint()
+    clear_checkpoint(checkpoint_file)
+    return events_sent
+
+
+def main():
+    try:
+        list_entities(*get_user_input())
+    except RuntimeError as e:
+        print(e)
+        exit(1)
 
 
 if __name__ == "__main__":
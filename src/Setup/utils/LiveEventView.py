@@ -0,0 +1,97 @@
+"""Show current Health events by merging the critical event hot table with awshealthevent_latest.
+
+The hot table holds critical events seconds after they reach the DataCollection
+bus, the latest table holds everything that went through Firehose and the merge.
+For an event present in both, the version with the newest lastUpdatedTime wins.
+"""
+from datetime import datetime, timezone
+
+import boto3
+
+from AthenaQuery import result_rows, run_query
+
+LATEST_EVENTS_QUERY = """
+SELECT eventarn, account, service, eventtypecode, eventtypecategory, eventregion, statuscode,
+       to_unixtime(starttime) AS starttime, to_unixtime(endtime) AS endtime, to_unixtime(lastupdatedtime) AS lastupdatedtime
+FROM awshealthevent_latest
+WHERE lastupdatedtime >= current_timestamp - INTERVAL '{hours}' HOUR
+"""
+
+COLUMNS = ['eventArn', 'account', 'service', 'eventTypeCode', 'eventTypeCategory', 'eventRegion', 'statusCode', 'startTime', 'endTime', 'lastUpdatedTime']
+
+
+def scan_hot_table(table_name, region):
+    table = boto3.resource('dynamodb', region_name=region).Table(table_name)
+    items = []
+    kwargs = {}
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return [hot_row(item) for item in items]
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def hot_row(item):
+    row = {column: item.get(column) for column in COLUMNS}
+    for column in ['startTime', 'endTime', 'lastUpdatedTime']:
+        if row[column] is not None:
+            row[column] = int(row[column])
+    row['origin'] = 'hot'
+    return row
+
+
+def query_latest_events(database, workgroup, region, hours):
+    # Always fresh, the point of this view is to show what just changed
+    results = run_query(LATEST_EVENTS_QUERY.format(hours=int(hours)), database, region, workgroup=workgroup, use_cache=False)
+    rows = []
+    for result_row in result_rows(results):
+        row = dict(zip(COLUMNS, result_row.values()))
+        for column in ['startTime', 'endTime', 'lastUpdatedTime']:
+            row[column] = int(float(row[column])) if row[column] else None
+        row['origin'] = 'cold'
+        rows.append(row)
+    return rows
+
+
+def merge_events(hot_rows, cold_rows):
+    """Return one row per (eventArn, account), preferring the most recently updated version"""
+    merged = {}
+    for row in cold_rows + hot_rows:
+        key = (row['eventArn'], row['account'])
+        current = merged.get(key)
+        if current is None or (row['lastUpdatedTime'] or 0) >= (current['lastUpdatedTime'] or 0):
+            merged[key] = row
+    return sorted(merged.values(), key=lambda row: row['lastUpdatedTime'] or 0, reverse=True)
+
+
+def format_time(value):
+    return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%d %H:%M') if value else ''
+
+
+def print_events(rows):
+    print(f"{'LAST UPDATED':<17} {'ORIGIN':<6} {'STATUS':<8} {'CATEGORY':<20} {'SERVICE':<12} {'REGION':<15} {'ACCOUNT':<13} EVENT TYPE")
+    for row in rows:
+        print(f"{format_time(row['lastUpdatedTime']):<17} {row['origin']:<6} {row['statusCode'] or '':<8} {row['eventTypeCategory'] or '':<20} "
+              f"{row['service'] or '':<12} {row['eventRegion'] or '':<15} {row['account'] or '':<13} {row['eventTypeCode'] or ''}")
+
+
+def get_user_input():
+    region = input("Enter DataCollection region: ").strip()
+    resource_prefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ").strip() or "heidi-"
+    database = input(f"Enter HeidiDataCollectionDB name, Hit enter to use default ({resource_prefix}datacollectiondb): ").strip() or f"{resource_prefix}datacollectiondb"
+    hours = input("Enter how many hours of updates to show, Hit enter to use default (24): ").strip() or '24'
+    return region, resource_prefix, database, int(hours)
+
+
+def main():
+    region, resource_prefix, database, hours = get_user_input()
+    hot_rows = scan_hot_table(f"{resource_prefix}critical-events-{region}", region)
+    cold_rows = query_latest_events(database, f"{resource_prefix}materialization-{region}", region, hours)
+    rows = merge_events(hot_rows, cold_rows)
+    print(f"\n{len(rows)} events ({len(hot_rows)} from the hot table, {len(cold_rows)} from awshealthevent_latest)\n")
+    print_events(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Run the QuickSight dataset SQL locally with DuckDB over a copy of the DataCollection data.
+
+The raw tables are loaded from JSON (DataCollection-data) or Parquet
+(DataCollection-compacted) with the Glue schemas of GlueSchema, the latest
+state tables are built with the source query of the MERGE statements of
+HealthLatestStateLambda and accountsinfo is read from its CSV. The dataset SQL,
+its CTEs and every table it reads are then run with the Athena functions DuckDB
+lacks translated, and row counts and timings are reported.
+Requires duckdb and pyarrow (pip3 install duckdb pyarrow).
+"""
+import csv
+import io
+import re
+import statistics
+import time
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ColumnarCompaction import arrow_schema, conform_record, table_columns
+from DataLakeIO import iter_json_records, list_objects, read_object
+from GlueSchema import COMPACTED_PREFIX, DATA_PREFIX, TABLES
+from LambdaHarness import load_function
+from QueryProfiler import DATASET_TEMPLATE, TABLE_REFERENCE, closing_paren, load_dataset_sql, profile_queries
+
+LATEST_STATE_RESOURCE = "HealthLatestStateLambda"
+LATEST_STATE_QUERIES = {'awshealthevent_latest': 'LATEST_EVENT_MERGE', 'taginfo_latest': 'TAG_SNAPSHOT_MERGE'}
+ACCOUNTSINFO_PREFIX = "DataCollection-metadata/ReferenceOds/AccountsInfo/"
+# Column order of the accountsinfo Glue table, OpenCSVSerde maps CSV columns by position
+ACCOUNTSINFO_COLUMNS = ['accountid', 'arn', 'email', 'name', 'status', 'joinedmethod', 'joinedtimestamp', 'Tag', 'oupath']
+
+# Athena functions DuckDB has under another name or not at all
+MACROS = [
+    "CREATE MACRO array_join(items, separator) AS array_to_string(items, separator)",
+    "CREATE MACRO json_extract_scalar(json, path) AS json_extract_string(json, path)",
+    "CREATE MACRO from_iso8601_timestamp(value) AS CAST(value AS TIMESTAMPTZ)",
+    "CREATE MACRO from_unixtime(value) AS to_timestamp(value)",
+]
+TRANSLATIONS = [
+    (re.compile(r'\btransform\(', re.IGNORECASE), 'list_transform('),
+    (re.compile(r'\belement_at\(', re.IGNORECASE), 'list_extract('),
+    (re.compile(r'\bAS ROW\(', re.IGNORECASE), 'AS STRUCT('),
+]
+UNNEST_ALIAS = re.compile(r'(UNNEST\([^()]+\)\s+AS\s+(\w+))\((\w+)\)', re.IGNORECASE)
+DATE_PARSE = re.compile(r"\bdate_parse\(([^,()]+),\s*'([^']*)'\)", re.IGNORECASE)
+# Athena (Joda/MySQL style) specifiers that differ from strptime
+DATE_FORMAT_SPECIFIERS = {'%i': '%M', '%s': '%S', '%e': '%-d', '%c': '%-m', '%k': '%-H', '%T': '%H:%M:%S'}
+
+
+def translate(sql):
+    """Rewrite Athena SQL so DuckDB runs it against the local tables"""
+    sql = TABLE_REFERENCE.sub(lambda match: f'"{match.group("table")}"', sql)
+    for pattern, replacement in TRANSLATIONS:
+        sql = pattern.sub(replacement, sql)
+    # Athena resolves t(tags) before a column named tags of the unnested table, DuckDB calls it ambiguous
+    for _, alias, column in UNNEST_ALIAS.findall(sql):
+        sql = re.sub(rf'(?<![\w."]){column}\.', f'{alias}_{column}.', sql)
+    sql = UNNEST_ALIAS.sub(lambda match: f"{match.group(1)}({match.group(2)}_{match.group(3)})", sql)
+
+    def strptime(match):
+        date_format = re.sub(r'%[a-zA-Z]', lambda specifier: DATE_FORMAT_SPECIFIERS.get(specifier.group(0), specifier.group(0)), match.group(2))
+        return f"strptime({match.group(1)}, '{date_format}')"
+    return DATE_PARSE.sub(strptime, sql)
+
+
+def connect():
+    connection = duckdb.connect()
+    connection.execute("SET TimeZone='UTC'")
+    for macro in MACROS:
+        connection.execute(macro)
+    return connection
+
+
+def partition_columns(key, prefix):
+    """Return (source_partition, date_created) of an object below prefix/<source>/yyyy/MM/dd/"""
+    parts = key[len(prefix):].strip('/').split('/')
+    return parts[0], '/'.join(parts[1:4])
+
+
+def json_table(location, table_name, sources):
+    columns = table_columns(table_name)
+    rows = []
+    for source in sources:
+        for key, _ in list_objects(location, f"{DATA_PREFIX}/{source}/"):
+            source_partition, date_created = partition_columns(key, DATA_PREFIX)
+            for record in iter_json_records(read_object(location, key)):
+                rows.append({**conform_record(record, columns), 'date_created': date_created, 'source_partition': source_partition})
+    schema = arrow_schema(table_name).append(pa.field('date_created', pa.string())).append(pa.field('source_partition', pa.string()))
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+def parquet_table(location, table_name, sources):
+    schema = arrow_schema(table_name)
+    tables = []
+    for source in sources:
+        for key, _ in list_objects(location, f"{COMPACTED_PREFIX}/{source}/"):
+            if not key.endswith('.parquet'):
+                continue
+            source_partition, date_created = partition_columns(key, COMPACTED_PREFIX)
+            table = pq.read_table(io.BytesIO(read_object(location, key)), schema=schema)
+            table = table.append_column('date_created', pa.array([date_created] * table.num_rows, pa.string()))
+            tables.append(table.append_column('source_partition', pa.array([source_partition] * table.num_rows, pa.string())))
+    if not tables:
+        return json_table(location, table_name, [])
+    return pa.concat_tables(tables)
+
+
+def accountsinfo_table(location, accounts_csv=None):
+    """Read the accountsinfo CSV, from accounts_csv or the AccountsInfo prefix of location"""
+    bodies = []
+    if accounts_csv:
+        with open(accounts_csv, 'rb') as f:
+            bodies.append(f.read())
+    else:
+        bodies = [read_object(location, key) for key, _ in list_objects(location, ACCOUNTSINFO_PREFIX) if key.endswith('.csv')]
+    rows = []
+    for body in bodies:
+        # skip.header.line.count is 1, older exports have no OU path column
+        for values in list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))[1:]:
+            rows.append(dict(zip(ACCOUNTSINFO_COLUMNS, values + [None] * (len(ACCOUNTSINFO_COLUMNS) - len(values)))))
+    return pa.Table.from_pylist(rows, schema=pa.schema([pa.field(column, pa.string()) for column in ACCOUNTSINFO_COLUMNS]))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def load_tables(connection, location, data_format='json', accounts_csv=None):
+    """Register the raw tables and accountsinfo, return {table: (rows, seconds)}"""
+    loaded = {}
+    loader = parquet_table if data_format == 'parquet' else json_table
+    for table_name, table in TABLES.items():
+        arrow_table, seconds = timed(loader, location, table_name, table['sources'])
+        connection.register(table_name, arrow_table)
+        connection.register(f"{table_name}_compacted", arrow_table)
+        loaded[table_name] = (arrow_table.num_rows, seconds)
+    arrow_table, seconds = timed(accountsinfo_table, location, accounts_csv)
+    connection.register('accountsinfo', arrow_table)
+    loaded['accountsinfo'] = (arrow_table.num_rows, seconds)
+    return loaded
+
+
+def latest_state_queries(template_path):
+    """Return {table: source query} taken from the MERGE statements of HealthLatestStateLambda"""
+    function = load_function(template_path, LATEST_STATE_RESOURCE)
+    queries = {}
+    for table_name, variable in LATEST_STATE_QUERIES.items():
+        merge = function[variable].format(since='')
+        start = merge.index('USING (') + len('USING ')
+        queries[table_name] = merge[start + 1:closing_paren(merge, start)]
+    return queries
+
+
+def materialize_latest(connection, template_path):
+    """Build the latest state tables the way the MERGE fills an empty table, return {table: (rows, seconds)}"""
+    materialized = {}
+    for table_name, query in latest_state_queries(template_path).items():
+        start = time.perf_counter()
+        connection.execute(f'CREATE OR REPLACE TABLE "{table_name}" AS SELECT * EXCLUDE (rowrank) FROM ({translate(query)})')
+        rows = connection.execute(f'SELECT count(*) FROM "{table_name}"').fetchone()[0]
+        materialized[table_name] = (rows, time.perf_counter() - start)
+    return materialized
+
+
+def run_local(connection, sql, repeat=1):
+    """Run a query repeat times, return (rows, [seconds])"""
+    translated = translate(sql)
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = len(connection.execute(translated).fetchall())
+        timings.append(time.perf_counter() - start)
+    return rows, timings
+
+
+def print_report(title, results):
+    print(f"\n{title}")
+    print(f"{'NAME':<36} {'ROWS':>10} {'SECONDS':>9}")
+    for name, (rows, seconds) in results.items():
+        print(f"{name:<36} {rows:>10} {seconds:>9.3f}")
+
+
+def get_user_input():
+    location = input("Enter DataCollection location (local directory or s3://<DataCollectionBucket>): ").strip()
+    data_format = input("Enter data format, json (DataCollection-data) or parquet (DataCollection-compacted), Hit enter to use default (json): ").strip() or 'json'
+    accounts_csv = input(f"Enter accountsinfo CSV file, Hit enter to read {ACCOUNTSINFO_PREFIX} of the location: ").strip() or None
+    sql_file = input("Enter file with the SQL to run, Hit enter to run the QuickSight dataset SQL: ").strip()
+    repeat = input("Enter how many times to run each query, Hit enter to use default (3): ").strip() or '3'
+    return location, data_format, accounts_csv, sql_file, int(repeat)
+
+
+def main():
+    location, data_format, accounts_csv, sql_file, repeat = get_user_input()
+    if sql_file:
+        with open(sql_file, 'r') as f:
+            sql = f.read()
+    else:
+        sql = load_dataset_sql(DATASET_TEMPLATE, 'local')
+
+    connection = connect()
+    print_report("Loaded tables", load_tables(connection, location, data_format, accounts_csv))
+    print_report("Latest state tables", materialize_latest(connection, DATASET_TEMPLATE))
+
+    results = {}
+    for name, query in profile_queries(sql):
+        rows, timings = run_local(connection, query, repeat)
+        results[name] = (rows, statistics.median(timings))
+    print_report(f"Queries (median of {repeat} runs)", results)
+
+
+if __name__ == "__main__":
+    main()
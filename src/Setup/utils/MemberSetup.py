@@ -1,14 +1,4 @@
-import boto3
-import subprocess
-from botocore.exceptions import ClientError
-import os
-
-# Get Current Account ID
-def get_account_id():
-    # Get the AWS account ID for Unique names
-    sts_client = boto3.client("sts")
-    account_id = sts_client.get_caller_identity().get("Account")
-    return account_id
+from utils.StackDeployer import DEFAULT_MAX_PARALLEL, deploy_stacks, get_account_id, parse_regions
 
 # Get yes or no for modules
 def ask_yes_no(prompt):
@@ -21,6 +11,14 @@ def ask_yes_no(prompt):
         else:
             print("Invalid input. Please enter 'yes' or 'no'.")
 
+# Get a positive number, default on enter
+def ask_positive_int(prompt, default):
+    while True:
+        user_input = input(f"{prompt}, Hit enter to use default ({default}): ").strip() or str(default)
+        if user_input.isdigit() and int(user_input) > 0:
+            return int(user_input)
+        print("Invalid input. Please enter a positive number.")
+
 # Print pretty Box
 def print_boxed_text(text):
     lines = text.strip().split('\n')
@@ -31,14 +29,6 @@ def print_boxed_text(text):
         print(f' {line.ljust(max_length)} ')
     print('═' * (max_length + 2))
 
-
-# deploy stack
-def deploy_stack(command):
-    try:
-        subprocess.call(command, shell=True)
-    except Exception as e:
-        print("An error occurred:", e)
-
 # User Input Data
 def get_user_input():
     DeploymentRegionHealth = input("Enter comma-separated Region names for AWS health data collection: ")
@@ -46,29 +36,26 @@ def get_user_input():
     DataCollectionAccountID = input(f"Enter Data Collection Account ID, Default {get_account_id()}: ") or get_account_id()
     DataCollectionRegion = input("Enter Data Collection Region ID: ")
     ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+    MaxParallel = ask_positive_int("Enter how many regions to deploy in parallel", DEFAULT_MAX_PARALLEL)
     return (
-        DataCollectionAccountID, DataCollectionRegion, DeploymentRegionHealth, ResourcePrefix
+        DataCollectionAccountID, DataCollectionRegion, DeploymentRegionHealth, ResourcePrefix, MaxParallel
     )
 
 # setup
 def setup():
     parameters_dict = {}
-    DataCollectionAccountID, DataCollectionRegion, DeploymentRegionHealth, ResourcePrefix = get_user_input()
+    DataCollectionAccountID, DataCollectionRegion, DeploymentRegionHealth, ResourcePrefix, MaxParallel = get_user_input()
 
     parameters_dict['DataCollectionAccountID'] = DataCollectionAccountID
     parameters_dict['DataCollectionRegion'] = DataCollectionRegion
     parameters_dict['ResourcePrefix'] = ResourcePrefix
 
-    parameters = f"DataCollectionAccountID={parameters_dict['DataCollectionAccountID']} \
-                DataCollectionRegion={parameters_dict['DataCollectionRegion']} \
-                ResourcePrefix={parameters_dict['ResourcePrefix']}"
-
-    for region in DeploymentRegionHealth.split(','):
-        stack_name = f"{parameters_dict['ResourcePrefix']}HealthModule-member-{get_account_id()}-{region}"
-        command = f"sam deploy --stack-name {stack_name} --region {region} --parameter-overrides {parameters} \
-            --template-file ../HealthModule/HealthModuleCollectionSetup.yaml --capabilities CAPABILITY_NAMED_IAM --disable-rollback"
-        # Deploy Stack
-        deploy_stack(command)
+    stacks = {
+        region: f"{parameters_dict['ResourcePrefix']}HealthModule-member-{get_account_id()}-{region}"
+        for region in parse_regions(DeploymentRegionHealth)
+    }
+    # Deploy Stacks
+    deploy_stacks(stacks, '../HealthModule/HealthModuleCollectionSetup.yaml', parameters_dict, {}, max_parallel=MaxParallel)
 
 if __name__ == "__main__":
     setup()
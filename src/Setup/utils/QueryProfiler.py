@@ -0,0 +1,255 @@
+"""Profile the Athena cost of the QuickSight dataset SQL or of an ad-hoc query.
+
+The dataset SQL is read from the template, so what gets profiled is exactly what
+the SPICE refresh runs. The full query, every CTE and every table it reads are
+run separately over the chosen date range, and DataScannedInBytes, engine and
+queue time and the per-stage runtime statistics of each are printed and appended
+to a history file. A run can be compared against an earlier run used as baseline.
+"""
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+import yaml
+
+from AthenaQuery import get_athena_client, start_query, wait_for_query
+from GlueSchema import TABLES
+from LambdaHarness import TemplateLoader
+
+HISTORY_FILE = "query_profile_history.jsonl"
+DATASET_TEMPLATE = "../../HealthModule/HealthModuleDataSetSetup.yaml"
+DATASET_RESOURCE = "QSDataSetHealthEvent"
+PRICE_PER_TB_SCANNED = 5.0
+MIN_BYTES_BILLED = 10 * 1024 * 1024
+
+TABLE_REFERENCE = re.compile(r'"AwsDataCatalog"\."[^"]+"\."(?P<table>[^"]+)"')
+# Latest-state tables are filtered on the update time, raw and compacted tables on their partition
+LATEST_DATE_COLUMNS = {'awshealthevent_latest': 'lastupdatedtime'}
+PARTITIONED_TABLES = set(TABLES) | {f"{name}_compacted" for name in TABLES}
+
+
+def load_dataset_sql(template_path, database):
+    """Return the CustomSql of the dataset with the template parameters substituted"""
+    with open(template_path) as file:
+        template = yaml.load(file, Loader=TemplateLoader)
+    physical_table = next(iter(template['Resources'][DATASET_RESOURCE]['Properties']['PhysicalTableMap'].values()))
+    sql = physical_table['CustomSql']['SqlQuery']
+    return sql.replace('${ResourcePrefix}${HeidiDataCollectionDB}', database)
+
+
+def skip_literal(sql, position):
+    """Return the position after the string literal or quoted identifier starting at position"""
+    quote = sql[position]
+    position += 1
+    while position < len(sql):
+        if sql[position] == quote:
+            if sql[position + 1:position + 2] != quote:
+                return position + 1
+            position += 1
+        position += 1
+    return position
+
+
+def closing_paren(sql, position):
+    """Return the position of the parenthesis closing the one at position"""
+    depth = 0
+    while position < len(sql):
+        character = sql[position]
+        if character in "'\"":
+            position = skip_literal(sql, position)
+            continue
+        if character == '(':
+            depth += 1
+        elif character == ')':
+            depth -= 1
+            if depth == 0:
+                return position
+        position += 1
+    raise ValueError("Unbalanced parentheses in query")
+
+
+def split_ctes(sql):
+    """Return ([(name, body)], final SELECT) of a query, with no CTEs if it has no WITH clause"""
+    match = re.match(r'\s*WITH\s+', sql, re.IGNORECASE)
+    if not match:
+        return [], sql.strip()
+    ctes = []
+    position = match.end()
+    while True:
+        cte = re.compile(r'\s*(\w+)\s+AS\s*\(', re.IGNORECASE).match(sql, position)
+        if not cte:
+            raise ValueError(f"Cannot parse CTE at: {sql[position:position + 40]!r}")
+        end = closing_paren(sql, cte.end() - 1)
+        ctes.append((cte.group(1), sql[cte.end():end].strip()))
+        separator = re.compile(r'\s*,').match(sql, end + 1)
+        if not separator:
+            return ctes, sql[end + 1:].strip()
+        position = separator.end()
+
+
+def with_clause(ctes):
+    return "WITH " + ",\n".join(f"{name} AS (\n{body}\n)" for name, body in ctes) + "\n"
+
+
+def restrict_dates(sql, start, end):
+    """Replace every date-bound table reference with a subquery over [start, end)"""
+    def restrict(match):
+        table = match.group('table')
+        if table in LATEST_DATE_COLUMNS:
+            column = LATEST_DATE_COLUMNS[table]
+            condition = f"{column} >= TIMESTAMP '{start:%Y-%m-%d %H:%M:%S}' AND {column} < TIMESTAMP '{end:%Y-%m-%d %H:%M:%S}'"
+        elif table in PARTITIONED_TABLES:
+            condition = f"date_created >= '{start:%Y/%m/%d}' AND date_created < '{end:%Y/%m/%d}'"
+        else:
+            return match.group(0)
+        return f"(SELECT * FROM {match.group(0)} WHERE {condition})"
+    return TABLE_REFERENCE.sub(restrict, sql)
+
+
+def profile_queries(sql):
+    """Return [(name, sql)]: the full query, each CTE with the CTEs before it, and each table read"""
+    ctes, _ = split_ctes(sql)
+    queries = [('full query', sql)]
+    for index, (name, _) in enumerate(ctes):
+        queries.append((f"cte {name}", with_clause(ctes[:index + 1]) + f"SELECT * FROM {name}"))
+    for reference in dict.fromkeys(match.group(0) for match in TABLE_REFERENCE.finditer(sql)):
+        queries.append((f"table {TABLE_REFERENCE.match(reference).group('table')}", f"SELECT * FROM {reference}"))
+    return queries
+
+
+def flatten_stages(stage, stages=None):
+    stages = [] if stages is None else stages
+    if stage:
+        stages.append({
+            'stageId': stage.get('StageId'),
+            'state': stage.get('State'),
+            'executionTimeInMillis': stage.get('ExecutionTime', 0),
+            'inputBytes': stage.get('InputBytes', 0),
+            'inputRows': stage.get('InputRows', 0),
+            'outputBytes': stage.get('OutputBytes', 0),
+            'outputRows': stage.get('OutputRows', 0),
+        })
+        for sub_stage in stage.get('SubStages', []):
+            flatten_stages(sub_stage, stages)
+    return stages
+
+
+def profile_query(athena_client, name, sql, database, output_location, workgroup):
+    # Result reuse is disabled, a reused result reports no scanned bytes
+    query_execution_id = start_query(athena_client, sql, database, output_location, workgroup, max_age_minutes=0)
+    print(f"Profiling {name} ({query_execution_id})")
+    execution = wait_for_query(athena_client, query_execution_id)
+    statistics = execution.get('Statistics', {})
+    profile = {
+        'name': name,
+        'queryExecutionId': query_execution_id,
+        'state': execution['Status']['State'],
+        'dataScannedInBytes': statistics.get('DataScannedInBytes', 0),
+        'engineExecutionTimeInMillis': statistics.get('EngineExecutionTimeInMillis', 0),
+        'queryQueueTimeInMillis': statistics.get('QueryQueueTimeInMillis', 0),
+        'totalExecutionTimeInMillis': statistics.get('TotalExecutionTimeInMillis', 0),
+        'stages': [],
+    }
+    if profile['state'] != 'SUCCEEDED':
+        profile['error'] = execution['Status'].get('StateChangeReason', 'Unknown error')
+        return profile
+    try:
+        runtime = athena_client.get_query_runtime_statistics(QueryExecutionId=query_execution_id)['QueryRuntimeStatistics']
+        profile['stages'] = flatten_stages(runtime.get('OutputStage'))
+        profile['outputRows'] = runtime.get('Rows', {}).get('OutputRows')
+    except Exception as e:
+        print(f"No runtime statistics for {name}: {e}")
+    return profile
+
+
+def estimated_cost(scanned_bytes):
+    return max(scanned_bytes, MIN_BYTES_BILLED) / 1024 ** 4 * PRICE_PER_TB_SCANNED
+
+
+def load_history(history_file):
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(history_file, run):
+    with open(history_file, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+
+
+def find_baseline(history, label):
+    """Return the most recent run with the label, or None"""
+    runs = [run for run in history if run.get('label') == label]
+    return runs[-1] if runs else None
+
+
+def change(current, previous):
+    if not previous:
+        return ''
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def print_profiles(run, baseline=None):
+    previous = {profile['name']: profile for profile in baseline['profiles']} if baseline else {}
+    if baseline:
+        print(f"\nCompared against run '{baseline['label']}' of {baseline['timestamp']}")
+    print(f"\n{'QUERY':<36} {'SCANNED MB':>11} {'CHANGE':>8} {'ENGINE MS':>10} {'CHANGE':>8} {'QUEUE MS':>9} {'COST $':>9}")
+    for profile in run['profiles']:
+        if profile['state'] != 'SUCCEEDED':
+            print(f"{profile['name']:<36} {profile['state']}: {profile.get('error', '')}")
+            continue
+        before = previous.get(profile['name'], {})
+        print(f"{profile['name']:<36} {profile['dataScannedInBytes'] / 1024 ** 2:>11.1f} "
+              f"{change(profile['dataScannedInBytes'], before.get('dataScannedInBytes')):>8} "
+              f"{profile['engineExecutionTimeInMillis']:>10} "
+              f"{change(profile['engineExecutionTimeInMillis'], before.get('engineExecutionTimeInMillis')):>8} "
+              f"{profile['queryQueueTimeInMillis']:>9} {estimated_cost(profile['dataScannedInBytes']):>9.4f}")
+        for stage in profile['stages']:
+            print(f"    stage {stage['stageId']:<4} {stage['inputBytes'] / 1024 ** 2:>10.1f} MB in, {stage['inputRows']:>10} rows in, "
+                  f"{stage['outputRows']:>10} rows out, {stage['executionTimeInMillis']:>8} ms")
+
+
+def profile(sql, database, region, output_location, workgroup, start, end, label, history_file=HISTORY_FILE, baseline_label=None):
+    athena_client = get_athena_client(region)
+    run = {
+        'label': label,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'profiles': [profile_query(athena_client, name, restrict_dates(query, start, end), database, output_location, workgroup)
+                     for name, query in profile_queries(sql)],
+    }
+    baseline = find_baseline(load_history(history_file), baseline_label) if baseline_label else None
+    append_history(history_file, run)
+    print_profiles(run, baseline)
+    return run
+
+
+def get_user_input():
+    region = input("Enter DataCollection region: ").strip()
+    resource_prefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ").strip() or "heidi-"
+    database = input(f"Enter HeidiDataCollectionDB name, Hit enter to use default ({resource_prefix}datacollectiondb): ").strip() or f"{resource_prefix}datacollectiondb"
+    workgroup = input(f"Enter Athena workgroup, Hit enter to use default ({resource_prefix}materialization-{region}): ").strip() or f"{resource_prefix}materialization-{region}"
+    output_location = input("Enter Athena output location (s3://...), Hit enter to use the workgroup setting: ").strip() or None
+    sql_file = input("Enter file with the SQL to profile, Hit enter to profile the QuickSight dataset SQL: ").strip()
+    days = input("Enter how many days back to profile, Hit enter to use default (30): ").strip() or '30'
+    label = input("Enter a label for this run, Hit enter to use the current time: ").strip() or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    baseline_label = input("Enter label of the run to compare against, Hit enter to skip: ").strip() or None
+    return region, database, workgroup, output_location, sql_file, int(days), label, baseline_label
+
+
+def main():
+    region, database, workgroup, output_location, sql_file, days, label, baseline_label = get_user_input()
+    if sql_file:
+        with open(sql_file, 'r') as f:
+            sql = f.read()
+    else:
+        sql = load_dataset_sql(DATASET_TEMPLATE, database)
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    profile(sql, database, region, output_location, workgroup, end - timedelta(days=days), end, label, baseline_label=baseline_label)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""QuickSight user directory for the setup scripts.
+
+Users of every namespace are listed with full pagination, namespaces in
+parallel, and cached locally for CACHE_TTL_MINUTES so a rerun of the setup does
+not list them again. select_user lets the user narrow the list by substring or
+role before picking one.
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+CACHE_FILE = "utils/.QuickSightUsers.json"
+CACHE_TTL_MINUTES = 60
+PAGE_SIZE = 25
+MAX_WORKERS = 8
+
+
+def list_namespaces(quicksight_client, account_id):
+    paginator = quicksight_client.get_paginator('list_namespaces')
+    return [namespace['Name'] for page in paginator.paginate(AwsAccountId=account_id) for namespace in page['Namespaces']]
+
+
+def list_namespace_users(quicksight_client, account_id, namespace):
+    paginator = quicksight_client.get_paginator('list_users')
+    return [
+        {
+            'arn': user['Arn'],
+            'userName': user.get('UserName', ''),
+            'email': user.get('Email', ''),
+            'role': user.get('Role', ''),
+            'active': user.get('Active', True),
+            'namespace': namespace,
+        }
+        for page in paginator.paginate(AwsAccountId=account_id, Namespace=namespace)
+        for user in page['UserList']
+    ]
+
+
+def list_users(account_id, region):
+    """Return every user of every namespace, namespaces listed in parallel"""
+    quicksight_client = boto3.client('quicksight', region_name=region)
+    namespaces = list_namespaces(quicksight_client, account_id)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        users = executor.map(lambda namespace: list_namespace_users(quicksight_client, account_id, namespace), namespaces)
+        return sorted((user for namespace_users in users for user in namespace_users), key=lambda user: user['arn'])
+
+
+def load_cache(cache_file, cache_key, ttl_minutes):
+    try:
+        with open(cache_file, 'r') as f:
+            entry = json.load(f).get(cache_key)
+    except (OSError, ValueError):
+        return None
+    if not entry or time.time() - entry['created'] > ttl_minutes * 60:
+        return None
+    return entry['users']
+
+
+def save_cache(cache_file, cache_key, users):
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache[cache_key] = {'created': time.time(), 'users': users}
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f)
+
+
+def get_users(account_id, region, cache_file=CACHE_FILE, ttl_minutes=CACHE_TTL_MINUTES, refresh=False):
+    """Return the cached users of the account and region, listing them when the cache expired"""
+    cache_key = f"{account_id}:{region}"
+    users = None if refresh else load_cache(cache_file, cache_key, ttl_minutes)
+    if users is None:
+        users = list_users(account_id, region)
+        if users:
+            save_cache(cache_file, cache_key, users)
+    else:
+        print(f"Using QuickSight users cached in {cache_file}, enter 'refresh' to list them again")
+    return users
+
+
+def filter_users(users, text):
+    """Keep users whose ARN, name or email contains text; 'role:<ROLE>' keeps users with that role"""
+    text = text.strip()
+    if text.lower().startswith('role:'):
+        role = text[len('role:'):].strip().upper()
+        return [user for user in users if user['role'].upper() == role]
+    return [user for user in users if any(text.lower() in user[field].lower() for field in ['arn', 'userName', 'email'])]
+
+
+def print_users(users):
+    for index, user in enumerate(users[:PAGE_SIZE], 1):
+        inactive = '' if user['active'] else ', inactive'
+        print(f"{index}. {user['arn']} ({user['role']}{inactive})")
+    if len(users) > PAGE_SIZE:
+        print(f"... {len(users) - PAGE_SIZE} more, enter text or role:<ROLE> to narrow the list")
+    print()
+
+
+def select_user(account_id, region):
+    """Prompt until a user is picked and return its ARN, or None when there are no users"""
+    all_users = get_users(account_id, region)
+    if not all_users:
+        return None
+    users = all_users
+    while True:
+        print(f"\nAvailable QuickSight Users ({len(users)} of {len(all_users)})")
+        print_users(users)
+        choice = input("Enter the number of the QuickSight user, text or role:<ROLE> to filter, or enter to show all: ").strip()
+        if choice.isdigit():
+            if 1 <= int(choice) <= min(len(users), PAGE_SIZE):
+                return users[int(choice) - 1]['arn']
+            print("Invalid Option")
+        elif choice == 'refresh':
+            all_users = users = get_users(account_id, region, refresh=True)
+        elif choice:
+            filtered = filter_users(all_users, choice)
+            if filtered:
+                users = filtered
+            else:
+                print("No QuickSight user matches the filter")
+        else:
+            users = all_users
@@ -0,0 +1,81 @@
+"""Store of raw Health API responses for the backfill scripts.
+
+Each record holds the responses the backfill fetched for one event and scope
+(an affected account, or the whole event) at one lastUpdatedTime, gzip
+compressed JSON at
+RawHealthResponses/<eventArn hash>/<scope>/<lastUpdatedTime epoch>.json.gz
+below an s3://bucket[/prefix] URI or a local directory. The keys alone tell
+which versions are stored, so a backfill can skip events whose
+lastUpdatedTime did not change, and the records can be turned into events
+again after get_event_data or the schema changes without calling the API.
+"""
+import gzip
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from DataLakeIO import list_objects, read_object, write_object
+
+STORE_PREFIX = "RawHealthResponses"
+MAX_WORKERS = 16
+
+
+def event_hash(event_arn):
+    return hashlib.sha256(event_arn.encode('utf-8')).hexdigest()[:32]
+
+
+def version(last_updated_time):
+    """Epoch seconds of a lastUpdatedTime, 0 when the event has none"""
+    return int(last_updated_time.timestamp()) if last_updated_time else 0
+
+
+def record_key(event_arn, scope, last_updated_time):
+    return f"{STORE_PREFIX}/{event_hash(event_arn)}/{scope}/{version(last_updated_time):012d}.json.gz"
+
+
+def encode(record):
+    # Datetimes of the responses are tagged so decode gives back what boto3 returned
+    default = lambda value: {'__datetime__': value.isoformat()} if isinstance(value, datetime) else str(value)
+    return gzip.compress(json.dumps(record, default=default, separators=(',', ':')).encode('utf-8'))
+
+
+def decode(body):
+    hook = lambda value: datetime.fromisoformat(value['__datetime__']) if set(value) == {'__datetime__'} else value
+    return json.loads(body, object_hook=hook)
+
+
+def save_record(location, event_arn, scope, last_updated_time, record):
+    write_object(location, record_key(event_arn, scope, last_updated_time), encode(record))
+
+
+def stored_versions(location):
+    """Return {(eventArn hash, scope): latest stored version}"""
+    versions = {}
+    for key, _ in list_objects(location, f"{STORE_PREFIX}/"):
+        parts = key[len(STORE_PREFIX) + 1:].split('/')
+        if len(parts) != 3 or not parts[2].endswith('.json.gz'):
+            continue
+        stored = int(parts[2][:-len('.json.gz')])
+        versions[(parts[0], parts[1])] = max(stored, versions.get((parts[0], parts[1]), 0))
+    return versions
+
+
+def is_current(versions, event_arn, scope, last_updated_time):
+    """True when the store has this or a later version of the event and scope"""
+    return versions.get((event_hash(event_arn), scope), -1) >= version(last_updated_time)
+
+
+def latest_records(location, max_workers=MAX_WORKERS):
+    """Return {eventArn hash: {scope: record}} with the latest version of every event and scope"""
+    keys = {
+        (hash_value, scope): f"{STORE_PREFIX}/{hash_value}/{scope}/{stored:012d}.json.gz"
+        for (hash_value, scope), stored in stored_versions(location).items()
+    }
+    records = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # read_object already decompresses .gz objects
+        bodies = executor.map(lambda key: read_object(location, key), keys.values())
+        for (hash_value, scope), body in zip(keys, bodies):
+            records.setdefault(hash_value, {})[scope] = decode(body)
+    return records
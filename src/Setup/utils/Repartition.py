@@ -0,0 +1,92 @@
+"""Move DataCollection-data objects into the extended partition layout.
+
+With EnableExtendedPartitioning, Firehose writes below
+DataCollection-data/<source>/<yyyy>/<MM>/<dd>/<event_category>/<account_bucket>/
+and the awshealthevent table only reads that layout. Objects written directly
+below the date are split by category and account bucket, written to the new
+prefixes and, once written, the original is removed. Rerunning only picks up
+objects still in the old layout.
+"""
+import hashlib
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from DataLakeIO import delete_object, iter_json_records, list_objects, list_partitions, read_object, write_object
+from GlueSchema import DATA_PREFIX, all_sources, extended_partition
+
+
+def old_layout_objects(location, source, partition):
+    """Return keys of the partition that sit directly below the date"""
+    prefix = f"{DATA_PREFIX}/{source}/{partition}/"
+    return [key for key, _ in list_objects(location, prefix) if '/' not in key[len(prefix):]]
+
+
+def repartition_object(source_location, target_location, key, account_buckets, dry_run, keep_original):
+    groups = {}
+    for record in iter_json_records(read_object(source_location, key)):
+        groups.setdefault(extended_partition(record, account_buckets), []).append(record)
+
+    directory = key.rpartition('/')[0]
+    # Named after the input object, so a rerun overwrites instead of duplicating
+    name = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    if not dry_run:
+        for suffix, records in groups.items():
+            body = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+            write_object(target_location, f"{directory}/{suffix}/repartition-{name}.json", body)
+        if not keep_original:
+            delete_object(source_location, key)
+    return Counter({suffix: len(records) for suffix, records in groups.items()})
+
+
+def repartition(source_location, target_location, sources, account_buckets, date_from='', date_to='', dry_run=True, keep_original=False, max_workers=8):
+    """Repartition every old layout object of the sources within [date_from, date_to] (yyyy/MM/dd, inclusive)"""
+    keys = []
+    for source in sources:
+        for partition in list_partitions(source_location, f"{DATA_PREFIX}/{source}/"):
+            if (not date_from or partition >= date_from) and (not date_to or partition <= date_to):
+                keys.extend(old_layout_objects(source_location, source, partition))
+    print(f"Found {len(keys)} objects in the old layout")
+
+    records = Counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(repartition_object, source_location, target_location, key, account_buckets, dry_run, keep_original): key
+            for key in keys
+        }
+        for future in as_completed(futures):
+            try:
+                records.update(future.result())
+            except Exception as e:
+                failed += 1
+                print(f"Error repartitioning {futures[future]}: {e}")
+
+    for suffix, count in sorted(records.items()):
+        print(f"{'would write' if dry_run else 'wrote'}: <date>/{suffix} ({count} records)")
+    print(f"\nRepartition complete: {sum(records.values())} records from {len(keys) - failed} objects, {failed} objects failed")
+    return failed
+
+
+def get_user_input():
+    source_location = input("Enter DataCollection location (s3://<DataCollectionBucket> or local directory): ").strip()
+    target_location = input(f"Enter output location, Hit enter to use default ({source_location}): ").strip() or source_location
+    sources = input(f"Enter comma-separated sources, Hit enter to use default ({','.join(all_sources())}): ").strip()
+    account_buckets = input("Enter AccountBucketCount of the stack, Hit enter to use default (16): ").strip() or '16'
+    date_from = input("Enter first partition date (yyyy/MM/dd), Hit enter for all: ").strip()
+    date_to = input("Enter last partition date (yyyy/MM/dd), Hit enter for all: ").strip()
+    dry_run = input("Dry run, only count records (yes/no), Hit enter to use default (yes): ").strip().lower() != 'no'
+    source_list = [source.strip() for source in sources.split(',') if source.strip()] or all_sources()
+    return source_location, target_location, source_list, int(account_buckets), date_from, date_to, dry_run
+
+
+def main():
+    source_location, target_location, sources, account_buckets, date_from, date_to, dry_run = get_user_input()
+    # Originals are only removed when rewriting in place, a separate target keeps the source intact
+    keep_original = target_location != source_location
+    if repartition(source_location, target_location, sources, account_buckets, date_from, date_to, dry_run, keep_original):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Replay Firehose error output or archived raw events without calling the Health API.
+
+Objects under DataCollection-error/ hold Firehose error envelopes with the
+original record base64 encoded in rawData; any other object is read as raw
+events. Records are re-partitioned by source and date and either written back
+under DataCollection-data/ or put on the DataCollection bus in batches.
+Records written back land in their original arrival-date partitions, which the
+scheduled latest-state merge no longer reads, so HealthLatestStateLambda is
+invoked afterwards to merge from the oldest replayed partition.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import boto3
+
+from DataLakeIO import iter_json_records, list_objects, read_object, write_object
+from GlueSchema import DATA_PREFIX, all_sources, extended_partition
+
+ERROR_PREFIX = "DataCollection-error/"
+PUT_EVENTS_BATCH = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+checkpoint_lock = threading.Lock()
+
+
+def save_checkpoint(checkpoint_file, completed):
+    with checkpoint_lock:
+        with open(checkpoint_file, 'w') as f:
+            json.dump({'completed': sorted(completed), 'timestamp': datetime.now().isoformat()}, f)
+
+
+def load_checkpoint(checkpoint_file):
+    if os.path.exists(checkpoint_file):
+        try:
+            with open(checkpoint_file, 'r') as f:
+                completed = set(json.load(f)['completed'])
+            print(f"Checkpoint loaded: {len(completed)} objects already replayed")
+            return completed
+        except Exception as e:
+            print(f"Error loading checkpoint: {e}")
+    return set()
+
+
+def clear_checkpoint(checkpoint_file):
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+        print("Checkpoint file removed after successful completion")
+
+
+def decode_records(body):
+    """Yield (event, arrival datetime or None) for every record of an object"""
+    for record in iter_json_records(body):
+        if 'rawData' in record:
+            arrival = datetime.fromtimestamp(record['arrivalTimestamp'] / 1000, timezone.utc) if record.get('arrivalTimestamp') else None
+            for event in iter_json_records(base64.b64decode(record['rawData'])):
+                yield event, arrival
+        else:
+            yield record, None
+
+
+def partition_of(event, arrival, account_buckets=0):
+    # Firehose partitions by arrival date; fall back to the event time for archived events
+    if arrival is None:
+        arrival = datetime.fromisoformat(event['time'].replace('Z', '+00:00')) if event.get('time') else datetime.now(timezone.utc)
+    partition = f"{event['source']}/{arrival.strftime('%Y/%m/%d')}"
+    return f"{partition}/{extended_partition(event, account_buckets)}" if account_buckets else partition
+
+
+def group_records(body, account_buckets=0):
+    """Return ({partition: [events]}, skipped counter)"""
+    known_sources = set(all_sources())
+    partitions = {}
+    skipped = Counter()
+    for event, arrival in decode_records(body):
+        if not isinstance(event, dict) or event.get('source') not in known_sources:
+            skipped['unknown source'] += 1
+            continue
+        partitions.setdefault(partition_of(event, arrival, account_buckets), []).append(event)
+    return partitions, skipped
+
+
+def write_partitions(target_location, object_key, partitions):
+    # Named after the input object, so a rerun overwrites instead of duplicating
+    name = hashlib.sha256(object_key.encode('utf-8')).hexdigest()[:16]
+    for partition, events in partitions.items():
+        body = ''.join(json.dumps(event) + '\n' for event in events).encode('utf-8')
+        write_object(target_location, f"{DATA_PREFIX}/{partition}/replay-{name}.json", body)
+
+
+def event_batches(events, event_bus_arn):
+    batch, size = [], 0
+    for event in events:
+        entry = {
+            'Source': event['source'],
+            'DetailType': event.get('detail-type', 'Heidi replayed event'),
+            'Detail': json.dumps(event.get('detail', {})),
+            'EventBusName': event_bus_arn,
+            'Resources': event.get('resources', []),
+        }
+        if event.get('time'):
+            entry['Time'] = datetime.fromisoformat(event['time'].replace('Z', '+00:00'))
+        entry_size = len(entry['Detail']) + len(entry['Source']) + len(entry['DetailType']) + sum(len(resource) for resource in entry['Resources'])
+        if batch and (len(batch) == PUT_EVENTS_BATCH or size + entry_size > PUT_EVENTS_MAX_BYTES):
+            yield batch
+            batch, size = [], 0
+        batch.append(entry)
+        size += entry_size
+    if batch:
+        yield batch
+
+
+def put_partitions(eventbridge_client, event_bus_arn, partitions):
+    for batch in event_batches([event for events in partitions.values() for event in events], event_bus_arn):
+        response = eventbridge_client.put_events(Entries=batch)
+        if response.get('FailedEntryCount'):
+            raise RuntimeError(f"{response['FailedEntryCount']} events failed: {[entry.get('ErrorMessage') for entry in response['Entries'] if entry.get('ErrorCode')]}")
+
+
+def replay_object(source_location, object_key, target, target_location, event_bus, dry_run, account_buckets=0):
+    partitions, skipped = group_records(read_object(source_location, object_key), account_buckets)
+    if target == 'bus':
+        # Sources starting with aws. are reserved and cannot be put on a bus
+        for partition in [partition for partition in partitions if partition.startswith('aws.')]:
+            skipped['reserved source, use data target'] += len(partitions.pop(partition))
+    if not dry_run:
+        if target == 'bus':
+            put_partitions(*event_bus, partitions)
+        else:
+            write_partitions(target_location, object_key, partitions)
+    return Counter({partition: len(events) for partition, events in partitions.items()}), skipped
+
+
+def oldest_partition_date(records):
+    """Return the yyyy/MM/dd of the oldest partition of {partition: count}, or None when it is empty"""
+    dates = ['/'.join(partition.split('/')[1:4]) for partition in records]
+    return min(dates) if dates else None
+
+
+def merge_replayed(function_name, since, region=None):
+    # The merge can run for minutes, so the function is invoked asynchronously
+    boto3.client('lambda', region).invoke(FunctionName=function_name, InvocationType='Event', Payload=json.dumps({'since': since}).encode('utf-8'))
+    print(f"Invoked {function_name} to merge partitions since {since}, see its CloudWatch logs for the result")
+
+
+def replay(source_location, prefix, target, target_location, checkpoint_file, dry_run=False, max_workers=8, event_bus=None, account_buckets=0):
+    """Replay every object below prefix; event_bus is (events client, bus ARN) for the bus target.
+
+    account_buckets is the AccountBucketCount of a stack with EnableExtendedPartitioning, 0 otherwise.
+    Returns the number of failed objects and the replayed {partition: records}.
+    """
+    completed = set() if dry_run else load_checkpoint(checkpoint_file)
+    object_keys = [key for key, _ in list_objects(source_location, prefix) if key not in completed]
+    print(f"Found {len(object_keys)} objects to replay under {prefix}")
+
+    records = Counter()
+    skipped = Counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(replay_object, source_location, key, target, target_location, event_bus, dry_run, account_buckets): key
+            for key in object_keys
+        }
+        for index, future in enumerate(as_completed(futures), 1):
+            key = futures[future]
+            try:
+                object_records, object_skipped = future.result()
+                records.update(object_records)
+                skipped.update(object_skipped)
+                if not dry_run:
+                    completed.add(key)
+                    if index % 100 == 0:
+                        save_checkpoint(checkpoint_file, completed)
+            except Exception as e:
+                failed += 1
+                print(f"Error replaying {key}: {e}")
+
+    if not dry_run:
+        save_checkpoint(checkpoint_file, completed)
+        if not failed:
+            clear_checkpoint(checkpoint_file)
+    for partition, count in sorted(records.items()):
+        print(f"{'would replay' if dry_run else 'replayed'}: {partition} ({count} records)")
+    for reason, count in skipped.items():
+        print(f"skipped: {count} records ({reason})")
+    print(f"\nReplay complete: {sum(records.values())} records from {len(object_keys) - failed} objects, {failed} objects failed")
+    return failed, records
+
+
+def get_user_input():
+    source_location = input("Enter location to replay from (s3://<DataCollectionBucket> or local directory): ").strip()
+    prefix = input(f"Enter prefix to replay, Hit enter to use default ({ERROR_PREFIX}): ").strip() or ERROR_PREFIX
+    target = input("Enter replay target, data (write to DataCollection-data) or bus (put on DataCollection bus), Hit enter to use default (data): ").strip() or 'data'
+    dry_run = input("Dry run, only count records (yes/no), Hit enter to use default (yes): ").strip().lower() != 'no'
+    return source_location, prefix, target, dry_run
+
+
+def main():
+    source_location, prefix, target, dry_run = get_user_input()
+    target_location = source_location
+    event_bus = None
+    account_buckets = 0
+    if target == 'bus':
+        data_collection_account_id = input("Enter DataCollection Account ID: ")
+        data_collection_region = input("Enter DataCollection region: ")
+        resource_prefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+        event_bus_arn = f"arn:aws:events:{data_collection_region}:{data_collection_account_id}:event-bus/{resource_prefix}DataCollectionBus-{data_collection_account_id}"
+        event_bus = (boto3.client('events', data_collection_region), event_bus_arn)
+    elif target == 'data':
+        target_location = input(f"Enter DataCollection location to write to, Hit enter to use default ({source_location}): ").strip() or source_location
+        account_buckets = int(input("Enter AccountBucketCount if EnableExtendedPartitioning is yes, Hit enter if it is not: ").strip() or 0)
+    else:
+        print("Invalid target, use data or bus")
+        exit(1)
+    checkpoint_file = f"checkpoint_replay_{hashlib.sha256((source_location + prefix + target).encode('utf-8')).hexdigest()[:12]}.json"
+    failed, records = replay(source_location, prefix, target, target_location, checkpoint_file, dry_run, event_bus=event_bus, account_buckets=account_buckets)
+    since = oldest_partition_date(records)
+    if target == 'data' and not dry_run and since:
+        function_name = input("Enter HealthLatestStateLambda function name to merge the replayed partitions, Hit enter to skip: ").strip()
+        if function_name:
+            merge_replayed(function_name, since)
+        else:
+            print(f"Replayed records reach awshealthevent_latest once HealthLatestStateLambda is invoked with {json.dumps({'since': since})}")
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Upload a local directory to S3, sending only files that changed since the last sync.
+
+A local manifest records the SHA-256 of every file last uploaded to each
+destination. Files whose hash matches the manifest are skipped without any S3
+call; the rest are uploaded concurrently with multipart transfers.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+
+MANIFEST_FILE = "utils/.SyncManifest.json"
+EXCLUDED_DIRECTORIES = {'__pycache__'}
+MAX_WORKERS = 8
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024, max_concurrency=4)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def local_files(source):
+    """Yield (relative key, path) for every file below source, skipping caches and hidden files"""
+    for directory, directories, files in os.walk(source):
+        directories[:] = sorted(name for name in directories if name not in EXCLUDED_DIRECTORIES and not name.startswith('.'))
+        for file_name in sorted(files):
+            if file_name.startswith('.') or file_name.endswith('.pyc'):
+                continue
+            path = os.path.join(directory, file_name)
+            yield os.path.relpath(path, source).replace(os.sep, '/'), path
+
+
+def load_manifest(manifest_file, destination):
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f).get(destination, {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest_file, destination, entries):
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest[destination] = entries
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def plan_sync(source, manifest):
+    """Return ({key: hash} of every file, [(key, path)] of files that changed)"""
+    hashes = {}
+    changed = []
+    for key, path in local_files(source):
+        hashes[key] = file_hash(path)
+        if manifest.get(key) != hashes[key]:
+            changed.append((key, path))
+    return hashes, changed
+
+
+def sync(source, bucket, prefix, manifest_file=MANIFEST_FILE, max_workers=MAX_WORKERS):
+    """Upload changed files of source to s3://bucket/prefix and return the number of failed uploads"""
+    destination = f"s3://{bucket}/{prefix}"
+    manifest = load_manifest(manifest_file, destination)
+    hashes, changed = plan_sync(source, manifest)
+    print(f"{len(changed)} of {len(hashes)} files changed since the last sync to {destination}")
+
+    s3_client = boto3.client('s3')
+    uploaded = {key: value for key, value in manifest.items() if key in hashes}
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(s3_client.upload_file, path, bucket, f"{prefix}/{key}", Config=TRANSFER_CONFIG): key
+            for key, path in changed
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                future.result()
+                uploaded[key] = hashes[key]
+                print(f"upload: {key} to {destination}/{key}")
+            except Exception as e:
+                failed += 1
+                uploaded.pop(key, None)
+                print(f"Error uploading {key}: {e}")
+
+    # Only successful uploads are recorded, failed files are retried on the next sync
+    save_manifest(manifest_file, destination, uploaded)
+    print(f"Sync complete: {len(changed) - failed} uploaded, {len(hashes) - len(changed)} unchanged, {failed} failed")
+    return failed
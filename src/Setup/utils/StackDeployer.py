@@ -0,0 +1,122 @@
+"""Deploy a CloudFormation template to several regions in parallel with sam deploy.
+
+Each stack is tagged with a hash of its template, the files it depends on, its
+parameters and its tags. A region whose stack already carries the same hash and
+is in a completed state is skipped, so rerunning the setup only touches regions
+that changed. Output of every deployment is streamed prefixed with its region.
+"""
+import glob
+import hashlib
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
+import boto3
+from botocore.exceptions import ClientError
+
+HASH_TAG_KEY = "HeidiDeploymentHash"
+DEFAULT_MAX_PARALLEL = 4
+STABLE_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+print_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_account_id():
+    """Return the account ID of the caller, resolved once per run"""
+    return boto3.client("sts").get_caller_identity().get("Account")
+
+
+@lru_cache(maxsize=None)
+def get_organization_id():
+    """Return the ID of the caller's AWS Organization, resolved once per run"""
+    return boto3.client('organizations').describe_organization()['Organization']['Id']
+
+
+def deployment_hash(template_file, parameters, tags, dependencies=()):
+    """Hash the template, the files matched by the dependency globs, the parameters and the tags"""
+    digest = hashlib.sha256()
+    for path in [template_file] + sorted({path for pattern in dependencies for path in glob.glob(pattern, recursive=True)}):
+        with open(path, 'rb') as f:
+            digest.update(path.encode('utf-8') + b'\0' + f.read())
+    digest.update(repr(sorted(parameters.items())).encode('utf-8'))
+    digest.update(repr(sorted(tags.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def deployed_hash(stack_name, region):
+    """Return the hash tag of a stack in a stable state, or None"""
+    try:
+        stack = boto3.client('cloudformation', region_name=region).describe_stacks(StackName=stack_name)['Stacks'][0]
+    except ClientError:
+        return None
+    if stack['StackStatus'] not in STABLE_STATUSES:
+        return None
+    return next((tag['Value'] for tag in stack.get('Tags', []) if tag['Key'] == HASH_TAG_KEY), None)
+
+
+def log(region, message):
+    with print_lock:
+        print(f"[{region}] {message}", flush=True)
+
+
+def sam_deploy(stack_name, region, template_file, parameters, tags):
+    """Run sam deploy, streaming its output, and return the exit code"""
+    command = [
+        'sam', 'deploy', '--stack-name', stack_name, '--region', region, '--template-file', template_file,
+        '--parameter-overrides', *[f"{key}={value}" for key, value in parameters.items()],
+        '--tags', *[f"{key}={value}" for key, value in tags.items()],
+        '--capabilities', 'CAPABILITY_NAMED_IAM', '--disable-rollback', '--no-fail-on-empty-changeset', '--no-confirm-changeset'
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in process.stdout:
+        if line.strip():
+            log(region, line.rstrip())
+    return process.wait()
+
+
+def deploy_region(stack_name, region, template_file, parameters, tags, dependencies=(), force=False):
+    """Deploy one stack unless it is unchanged; return 'deployed', 'skipped' or 'failed'"""
+    current = deployment_hash(template_file, parameters, tags, dependencies)
+    if not force and deployed_hash(stack_name, region) == current:
+        log(region, f"{stack_name} is up to date, skipping")
+        return 'skipped'
+    log(region, f"Deploying {stack_name}")
+    try:
+        exit_code = sam_deploy(stack_name, region, template_file, parameters, {**tags, HASH_TAG_KEY: current})
+    except Exception as e:
+        log(region, f"An error occurred: {e}")
+        return 'failed'
+    if exit_code:
+        log(region, f"{stack_name} failed with exit code {exit_code}")
+        return 'failed'
+    log(region, f"{stack_name} deployed")
+    return 'deployed'
+
+
+def deploy_stacks(stacks, template_file, parameters, tags, dependencies=(), max_parallel=DEFAULT_MAX_PARALLEL, force=False):
+    """Deploy {region: stack name} concurrently and return {region: status}"""
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        futures = {
+            executor.submit(deploy_region, stack_name, region, template_file, parameters, tags, dependencies, force): region
+            for region, stack_name in stacks.items()
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    print_summary(results)
+    return results
+
+
+def print_summary(results):
+    print("\nDeployment summary")
+    for region, status in sorted(results.items()):
+        print(f"  {region:<16} {status}")
+    failed = [region for region, status in results.items() if status == 'failed']
+    if failed:
+        print(f"Deployment failed in {', '.join(sorted(failed))}, rerun the setup to retry only the failed or changed regions")
+
+
+def parse_regions(regions):
+    """Return the unique, non-empty regions of a comma separated list, in order"""
+    return list(dict.fromkeys(region.strip() for region in regions.split(',') if region.strip()))
@@ -1,65 +1,37 @@
-import os
 import json
-import boto3
+from ClientPool import event_bus_arn, get_event_bus_client, iter_resource_tags
 
-DataCollectionAccountID = input("Enter DataCollection Account ID: ")
-DataCollectionRegion = input("Enter DataCollection region: ")
-ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
-ResourceExplorerViewArn = input("Enter Resource explorere view ARN: ")
+def get_user_input():
+    DataCollectionAccountID = input("Enter DataCollection Account ID: ")
+    DataCollectionRegion = input("Enter DataCollection region: ")
+    ResourcePrefix = input("Enter ResourcePrefix, Hit enter to use default (heidi-): ") or "heidi-"
+    ResourceExplorerViewArn = input("Enter Resource explorere view ARN: ")
+    return DataCollectionAccountID, DataCollectionRegion, ResourcePrefix, ResourceExplorerViewArn
 
-eventbridge_client = boto3.client('events',DataCollectionRegion)
-EventBusArnVal = f"arn:aws:events:{DataCollectionRegion}:{DataCollectionAccountID}:event-bus/{ResourcePrefix}DataCollectionBus-{DataCollectionAccountID}"
-
-def resource_explorer():
+def resource_explorer(view_arn, EventBusArn):
+    """Send the tags of every resource of the view, returns the number of events sent"""
+    sent = 0
     try:
-        # Get the Resource Explorer ARN and region
-        view_arn = ResourceExplorerViewArn
-        region = view_arn.split(":")[3]
-        
-        # Create a Resource Explorer client
-        resource_explorer = boto3.client('resource-explorer-2', region)
-        
-        # Create a paginator for listing resources
-        paginator = resource_explorer.get_paginator('list_resources')
-        
-        # Define pagination configuration
-        pagination_config = {
-            'MaxItems': 20000000,  # Total maximum items to return across all pages
-            'PageSize': 1000     # Number of items per page
-        }
-        
-        # Paginate through the resources with filters
-        response_iterator = paginator.paginate(
-            ViewArn=view_arn,
-            PaginationConfig=pagination_config
-        )
-        
-        for page in response_iterator:
-            for resource in page.get('Resources', []):
-                arn = resource.get('Arn')
-                tags = [{'entityKey': item['Key'], 'entityValue': item['Value']} 
-                        for prop in resource.get('Properties', []) 
-                        for item in prop.get('Data', [])]
-                
-                tag_data = {'entityArn': arn, 'tags': tags}
-                if tags:
-                    send_event(tag_data)
-                else:
-                    pass
+        # The listing is shared with ListAffectedEntities when both run in one HeidiRunner process.
+        # Untagged resources are sent too, so a resource whose last tag was removed gets an empty snapshot.
+        for arn, tags in iter_resource_tags(view_arn):
+            send_event({'entityArn': arn, 'tags': tags}, EventBusArn)
+            sent += 1
 
     except Exception as e:
         print(f"Error in resource_explorer: {e}")
+    return sent
 
-def send_event(tag_data):
+def send_event(tag_data, EventBusArn):
     try:
         
         # Put events to the specified Event Bus
-        response = eventbridge_client.put_events(
+        response = get_event_bus_client(EventBusArn).put_events(
             Entries=[{
                 'Source': 'heidi.taginfo',
                 'DetailType': 'Heidi tags from resource explorer',
                 'Detail': json.dumps(tag_data),
-                'EventBusName': EventBusArnVal
+                'EventBusName': EventBusArn
             }]
         )
         print(f"Event sent: {response}")
@@ -67,6 +39,9 @@ def send_event(tag_data):
     except Exception as e:
         print(f"Error in send_event: {e}")
 
-# Example usage
+def main():
+    DataCollectionAccountID, DataCollectionRegion, ResourcePrefix, ResourceExplorerViewArn = get_user_input()
+    resource_explorer(ResourceExplorerViewArn, event_bus_arn(DataCollectionAccountID, DataCollectionRegion, ResourcePrefix))
+
 if __name__ == "__main__":
-    resource_explorer()
+    main()